@@ -1,41 +1,103 @@
-from flask import Flask, request, jsonify, send_file, redirect, url_for, session
+"""
+Flask serving path for the /ask, /wpg and Google login routes.
+
+create_app() builds the application; `app` is created from it on first
+access, so both of these work:
+    gunicorn "app:create_app()"
+    gunicorn app:app
+Modules only some routes need (Authlib for login, the WPG client and store,
+the image store, batch) are imported by those routes, and Google's OpenID
+metadata is cached on disk, so a fresh worker is ready to serve /ask quickly.
+"""
+import time
+
+_import_started = time.perf_counter()
+
+from dotenv import load_dotenv
+
+# Load .env variables before config reads them at import time
+load_dotenv()
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import requests
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, send_file, redirect, url_for, session
 from flask_cors import CORS
+from flask.json.provider import DefaultJSONProvider
 from wolfram_api import (
     query_short_answer,
     query_spoken_result,
-    query_simple_api,
     query_full_results,
     query_llm_api,
-    WolframAPIError
+    stream_full_results,
+    query_simple_api,
+    stream_simple_api,
+    query_pod_index,
+    query_pod,
+    FULL_RESULTS_FORMATS,
+    WolframAPIError,
+    MODES,
 )
-from authlib.integrations.flask_client import OAuth
-from dotenv import load_dotenv
-import os
-import io
-import requests
-import json
+from models import ResultJSONMixin, SUBPOD_FIELDS
+import models
+from config import (
+    QUEZZIO_URLS,
+    METRICS_ENABLED,
+    WPG_STORE_WARM_ON_START,
+    GOOGLE_METADATA_URL,
+    OAUTH_METADATA_CACHE,
+    OAUTH_METADATA_TTL,
+)
+import http_client
+import metrics
+import scheduler as upstream_scheduler
+from scheduler import RateLimitedError
+from degradation import choose_mode
 
+logger = logging.getLogger(__name__)
 
-# Load .env variables
-load_dotenv()
+_import_seconds = time.perf_counter() - _import_started
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev_secret_key")  # Set a secure secret in production
-CORS(app, supports_credentials=True, origins=["http://localhost:8080"])
-
-# Google OAuth setup
-oauth = OAuth(app)
-google = oauth.register(
-    name='google',
-    client_id=os.environ.get("GOOGLE_CLIENT_ID"),
-    client_secret=os.environ.get("GOOGLE_CLIENT_SECRET"),
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-    client_kwargs={'scope': 'openid email profile'},
-    api_base_url='https://www.googleapis.com/oauth2/v1/',
-    userinfo_endpoint='https://openidconnect.googleapis.com/v1/userinfo',
-)
 
-@app.route("/ask", methods=["POST"])
+class JSONProvider(ResultJSONMixin, DefaultJSONProvider):
+    pass
+
+api = Blueprint("api", __name__)
+
+# --- Instrumentation: Server-Timing headers and Prometheus metrics ---
+
+if METRICS_ENABLED:
+    @api.before_app_request
+    def _start_request_timing():
+        metrics.start_request()
+
+    @api.after_app_request
+    def _finish_request_timing(response):
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.finish_request(route, request.method, response.status_code, response.headers)
+        return response
+
+    @api.route("/metrics", methods=["GET"])
+    def get_metrics():
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# --- Upstream rate limiting: fair queuing per user, 429 when the queue is full ---
+
+@api.before_app_request
+def _identify_user():
+    upstream_scheduler.set_current_user(upstream_scheduler.user_key(session.get("user"), request.remote_addr))
+
+@api.app_errorhandler(RateLimitedError)
+def rate_limited(e):
+    response = jsonify({"error": str(e)})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+@api.route("/ask", methods=["POST"])
 def ask():
     data = request.get_json()
     if not data:
@@ -45,45 +107,264 @@ def ask():
     if not question or not mode:
         return jsonify({"error": "Missing 'query' or 'mode' parameter"}), 400
 
+    if mode not in MODES:
+        return jsonify({"error": f"Unsupported mode: {mode}"}), 400
+    width = data.get("width")
+    if mode == "simple" and width is not None and (not isinstance(width, int) or width <= 0):
+        return jsonify({"error": "'width' must be a positive integer"}), 400
+    fields = data.get("fields")
+    if mode == "full" and fields is not None and (not isinstance(fields, list) or any(f not in SUBPOD_FIELDS for f in fields)):
+        return jsonify({"error": f"'fields' must be a list drawn from: {', '.join(SUBPOD_FIELDS)}"}), 400
+
+    # Under upstream latency or error pressure, a cheaper mode may be served instead.
+    # Streams only fall back to plaintext-only full results, which stream the same events.
+    stream = mode == "full" and bool(data.get("stream"))
+    served, degraded = choose_mode(
+        mode, lambda: _is_cached(mode, question, width), allowed=("full_plaintext",) if stream else None
+    )
     try:
-        if mode == "short_answer":
+        if stream:
+            formats = ["plaintext"] if served == "full_plaintext" else None
+            return _ndjson_response(stream_full_results(question, formats=formats), degraded)
+        if served == "short_answer":
             answer = query_short_answer(question)
-            return jsonify({"answer": answer})
-        elif mode == "spoken_result":
+        elif served == "spoken_result":
             answer = query_spoken_result(question)
-            return jsonify({"answer": answer})
-        elif mode == "simple":
-            image_bytes = query_simple_api(question)
-            return send_file(
-                io.BytesIO(image_bytes),
-                mimetype="image/png",
-                as_attachment=False,
-                download_name="result.png"
-            )
-        elif mode == "full":
-            answer = query_full_results(question)
-            return jsonify({"answer": answer})
-        elif mode == "llm":
+        elif served == "simple":
+            return _simple_image_response(question, width)
+        elif served == "full":
+            answer = query_full_results(question).to_dict(fields)
+        elif served == "full_plaintext":
+            answer = query_full_results(question, formats=["plaintext"]).to_dict(fields)
+        elif served == "llm":
             answer = query_llm_api(question)
-            return jsonify({"answer": answer})
         else:
-            return jsonify({"error": f"Unsupported mode: {mode}"}), 400
+            return jsonify({"error": f"Misconfigured fallback mode: {served}"}), 500
+    except WolframAPIError as e:
+        return jsonify({"error": str(e)}), 502
+
+    if degraded is not None:
+        return jsonify({"answer": answer, "degraded": degraded})
+    return jsonify({"answer": answer})
+
+def _is_cached(mode, question, width=None):
+    # Mirrors the calls ask() makes for mode.
+    if mode == "simple":
+        from image_store import image_store, image_key
+
+        if image_store is not None:
+            return image_store.contains(image_key(question, width))
+        return query_simple_api.is_cached(question, width=width)
+    return MODES[mode].is_cached(question)
+
+def _simple_image_response(question, width=None):
+    """
+    Streams the Simple API image to the client chunk by chunk. With the image
+    store enabled, the image is written to disk on the way through and repeat
+    requests are served from there; concurrent requests for the same image
+    wait for the first one's download instead of calling upstream themselves.
+    Stored images carry a Content-Location to GET /images/<digest>, which
+    unlike this POST route answers If-None-Match and Range requests. Without
+    the store, the image goes through the response cache like the other modes.
+    """
+    from image_store import image_store, image_key
+
+    if image_store is None:
+        return Response(query_simple_api(question, width=width), mimetype="image/png")
+
+    key = image_key(question, width)
+    response = _stored_image_response(image_store, key)
+    if response is not None:
+        return response
+
+    claim, leader = image_store.claim(key)
+    if not leader:
+        if claim.done.wait(image_store.claim_seconds) and claim.error is not None:
+            raise claim.error
+        response = _stored_image_response(image_store, key)
+        if response is not None:
+            return response
+        # The other download was cut short or timed out; fetch the image ourselves.
+        claim = None
+
+    try:
+        chunks = stream_simple_api(question, width=width)
+        content_type = next(chunks)
+    except BaseException as e:
+        if claim is not None:
+            image_store.release(key, claim, e)
+        raise
+    return Response(image_store.tee(key, chunks, claim), mimetype=content_type)
+
+def _stored_image_response(image_store, key):
+    digest, path = image_store.lookup(key)
+    if path is None:
+        return None
+    with metrics.phase("send_file"):
+        response = send_file(path, mimetype="image/png", download_name="result.png", etag=digest)
+    response.headers["Content-Location"] = url_for(".get_image", digest=digest)
+    return response
+
+def _ndjson_response(events, degraded=None):
+    """
+    Streams events as newline-delimited JSON. The first event is produced
+    before responding so that upstream failures still get a 502; later
+    failures are reported as a final {"type": "error"} line. degraded, if
+    given, is added to the final "result" event.
+    """
+    first = next(events)
+
+    def generate():
+        yield _ndjson_line(first, degraded)
+        try:
+            for event in events:
+                yield _ndjson_line(event, degraded)
+        except WolframAPIError as e:
+            yield models.dumps({"type": "error", "error": str(e)}) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+def _ndjson_line(event, degraded=None):
+    if degraded is not None and event.get("type") == "result":
+        event = dict(event, degraded=degraded)
+    return models.dumps(event) + "\n"
+
+@api.route("/images/<digest>", methods=["GET"])
+def get_image(digest):
+    from image_store import image_store
+
+    path = image_store.path_for(digest) if image_store is not None else None
+    if path is None:
+        return jsonify({"error": "Image not found"}), 404
+    with metrics.phase("send_file"):
+        return send_file(path, mimetype="image/png", etag=digest, max_age=31536000)
+
+@api.route("/ask/pods", methods=["POST"])
+def ask_pods():
+    data = request.get_json(silent=True) or {}
+    question = data.get("query")
+    if not question:
+        return jsonify({"error": "Missing 'query' parameter"}), 400
+
+    try:
+        return jsonify({"answer": query_pod_index(question)})
+    except WolframAPIError as e:
+        return jsonify({"error": str(e)}), 502
+
+@api.route("/ask/pod", methods=["POST"])
+def ask_pod():
+    data = request.get_json(silent=True) or {}
+    question = data.get("query")
+    podid = data.get("podid")
+    if not question or not podid:
+        return jsonify({"error": "Missing 'query' or 'podid' parameter"}), 400
+    formats = data.get("formats")
+    if formats is not None:
+        if not isinstance(formats, list) or any(f not in FULL_RESULTS_FORMATS for f in formats):
+            return jsonify({"error": f"'formats' must be a list drawn from: {', '.join(FULL_RESULTS_FORMATS)}"}), 400
 
+    try:
+        pod = query_pod(question, podid, podstate=data.get("podstate"), formats=formats)
+        return jsonify({"answer": pod})
     except WolframAPIError as e:
         return jsonify({"error": str(e)}), 502
 
+@api.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    from batch import parse_batch_request, run_batch, BatchRequestError
+
+    try:
+        items = parse_batch_request(request.get_json(silent=True))
+    except BatchRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(run_batch(items))
+
 # --- Google OAuth2 routes ---
 
-@app.route("/login")
+_oauth_lock = threading.Lock()
+
+
+def _load_google_metadata():
+    """
+    Returns Google's OpenID discovery document, read from OAUTH_METADATA_CACHE
+    while younger than OAUTH_METADATA_TTL and fetched (and cached) otherwise,
+    so every new worker does not fetch it on its first login. Falls back to a
+    stale copy if the fetch fails; returns None if there is none, in which
+    case Authlib fetches the document itself.
+    """
+    cached = None
+    if OAUTH_METADATA_CACHE:
+        try:
+            with open(OAUTH_METADATA_CACHE, encoding="utf-8") as f:
+                cached = json.load(f)
+            if time.time() - os.path.getmtime(OAUTH_METADATA_CACHE) < OAUTH_METADATA_TTL:
+                return cached
+        except (OSError, ValueError):
+            pass
+
+    try:
+        response = http_client.get(GOOGLE_METADATA_URL)
+        response.raise_for_status()
+        metadata = response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning("Could not fetch Google OpenID metadata (%s)", type(e).__name__)
+        return cached
+
+    if OAUTH_METADATA_CACHE:
+        directory = os.path.dirname(os.path.abspath(OAUTH_METADATA_CACHE))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, OAUTH_METADATA_CACHE)
+        except OSError as e:
+            logger.warning("Could not write OpenID metadata cache %s: %s", OAUTH_METADATA_CACHE, e)
+    return metadata
+
+
+def _google():
+    """
+    Returns the Google OAuth client of the current app, registering it on
+    first use: Authlib is only imported once somebody logs in.
+    """
+    app = current_app._get_current_object()
+    client = app.extensions.get("google_oauth")
+    if client is not None:
+        return client
+    with _oauth_lock:
+        client = app.extensions.get("google_oauth")
+        if client is None:
+            from authlib.integrations.flask_client import OAuth
+
+            oauth = OAuth(app)
+            client = oauth.register(
+                name='google',
+                client_id=os.environ.get("GOOGLE_CLIENT_ID"),
+                client_secret=os.environ.get("GOOGLE_CLIENT_SECRET"),
+                server_metadata_url=GOOGLE_METADATA_URL,
+                client_kwargs={'scope': 'openid email profile'},
+                api_base_url='https://www.googleapis.com/oauth2/v1/',
+                userinfo_endpoint='https://openidconnect.googleapis.com/v1/userinfo',
+            )
+            metadata = _load_google_metadata()
+            if metadata:
+                # Marks the metadata as loaded, so Authlib does not fetch it again.
+                client.server_metadata.update(metadata, _loaded_at=time.time())
+            app.extensions["google_oauth"] = client
+    return client
+
+
+@api.route("/login")
 def login():
     # Get 'next' param from query (default to '/')
     next_url = request.args.get('next', '/')
     session['next_url'] = next_url
-    redirect_uri = url_for('google_callback', _external=True)
-    return google.authorize_redirect(redirect_uri)
+    redirect_uri = url_for('.google_callback', _external=True)
+    return _google().authorize_redirect(redirect_uri)
 
-@app.route("/auth/google/callback")
+@api.route("/auth/google/callback")
 def google_callback():
+    google = _google()
     token = google.authorize_access_token()
     user_info = google.get('userinfo').json()
     session['user'] = user_info
@@ -92,12 +373,12 @@ def google_callback():
     # Redirect to the correct frontend route
     return redirect(f"http://localhost:8080{next_url}")
 
-@app.route("/logout")
+@api.route("/logout")
 def logout():
     session.pop('user', None)
     return redirect('/')
 
-@app.route("/auth/userinfo")
+@api.route("/auth/userinfo")
 def userinfo():
     if 'user' in session:
         return jsonify({"authenticated": True, "user": session['user']})
@@ -105,75 +386,101 @@ def userinfo():
         return jsonify({"authenticated": False}), 401
 
 
-@app.route("/wpg/topics", methods=["GET"])
+@api.route("/wpg/topics", methods=["GET"])
 def get_wpg_topics():
-    token_url = "https://quezzio.techconsulting.wolfram.com/api/quezzio/token"
-    client_id = os.environ.get("WPG_CLIENT_ID")
-    client_secret = os.environ.get("WPG_CLIENT_SECRET")
-    realm = os.environ.get("WPG_REALM", "futurestateuniversity")
+    import wpg_client
+    from wpg_client import WPGError, WPGCredentialsError
+    from wpg_store import wpg_store
 
-    if not client_id or not client_secret:
-        return jsonify({"error": "Missing WPG credentials in environment variables"}), 500
+    # Fetch topic-subject mapping, from the local store when it has it
+    if wpg_store is not None:
+        hit, topics = wpg_store.get_topics()
+        metrics.mark("wpg_store", "hit" if hit else "miss")
+        if hit:
+            return jsonify(topics)
 
-    token_payload = f'grant_type=client_credentials&auth_details={{"client_id":"{client_id}","client_secret":"{client_secret}"}}&realm={realm}'
-    token_headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
-    token_response = requests.post(token_url, headers=token_headers, data=token_payload)
-    if token_response.status_code != 200:
-        return jsonify({"error": "Failed to get access token"}), 502
-
-    access_token = token_response.json().get("access_token")
-    if not access_token:
-        return jsonify({"error": "No access token returned"}), 502
-
-    # Fetch topic-subject mapping
-    topics_url = "https://quezzio.techconsulting.wolfram.com/api/quezzio/wpg/metadata/topics"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.post(topics_url, headers=headers)
+    try:
+        response = wpg_client.post(QUEZZIO_URLS["topics"])
+    except WPGCredentialsError as e:
+        return jsonify({"error": str(e)}), 500
+    except WPGError as e:
+        return jsonify({"error": str(e)}), 502
 
     if response.status_code != 200:
         return jsonify({"error": "Failed to fetch topics", "details": response.text}), 502
 
-    return jsonify(response.json())
+    topics = response.json()
+    if wpg_store is not None:
+        wpg_store.put_topics(topics)
+    return jsonify(topics)
 
 
-@app.route("/wpg/questions", methods=["POST"])
+@api.route("/wpg/questions", methods=["POST"])
 def get_wpg_questions():
+    import wpg_client
+    from wpg_client import WPGError, WPGCredentialsError
+    from wpg_store import wpg_store
+
     data = request.get_json()
     wpg_input = data.get("wpg_input")
     if not wpg_input:
         return jsonify({"error": "Missing wpg_input"}), 400
 
-    token_url = "https://quezzio.techconsulting.wolfram.com/api/quezzio/token"
-    client_id = os.environ.get("WPG_CLIENT_ID")
-    client_secret = os.environ.get("WPG_CLIENT_SECRET")
-    realm = os.environ.get("WPG_REALM", "futurestateuniversity")
-
-    token_payload = f'grant_type=client_credentials&auth_details={{"client_id":"{client_id}","client_secret":"{client_secret}"}}&realm={realm}'
-    token_headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
-    token_response = requests.post(token_url, headers=token_headers, data=token_payload)
-    if token_response.status_code != 200:
-        return jsonify({"error": "Failed to get access token"}), 502
+    if wpg_store is not None:
+        questions = wpg_store.get_questions(wpg_input)
+        metrics.mark("wpg_store", "hit" if questions is not None else "miss")
+        if questions is not None:
+            return jsonify(questions)
 
-    access_token = token_response.json().get("access_token")
-    if not access_token:
-        return jsonify({"error": "No access token returned"}), 502
-
-    question_url = "https://quezzio.techconsulting.wolfram.com/api/quezzio/wpg/question"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    payload = {
-        "wpg_input": json.dumps(wpg_input),
-        "output_format": "MathML",
-        "show_steps_command": "true"
-    }
+    try:
+        response = wpg_client.post(QUEZZIO_URLS["question"], data=wpg_client.question_payload(wpg_input))
+    except WPGCredentialsError as e:
+        return jsonify({"error": str(e)}), 500
+    except WPGError as e:
+        return jsonify({"error": str(e)}), 502
 
-    response = requests.post(question_url, headers=headers, data=payload)
     if response.status_code != 200:
         return jsonify({"error": "Failed to fetch questions", "details": response.text}), 502
 
-    return jsonify(response.json())
+    questions = response.json()
+    if wpg_store is not None:
+        wpg_store.put_questions(wpg_input, questions)
+    return jsonify(questions)
+
+
+def create_app():
+    """
+    Builds the Flask application: JSON provider, session secret, CORS and
+    the routes. Records how long module imports and this setup took
+    (process_startup_seconds on /metrics, and logged at INFO).
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.json = JSONProvider(app)
+    app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev_secret_key")  # Set a secure secret in production
+    CORS(app, supports_credentials=True, origins=["http://localhost:8080"])
+    app.register_blueprint(api)
+
+    # Fill the local WPG store (topic catalog and question pools) without delaying startup
+    if WPG_STORE_WARM_ON_START:
+        from wpg_store import wpg_store
+        if wpg_store is not None:
+            wpg_store.warm_in_background()
+
+    setup_seconds = time.perf_counter() - started
+    metrics.record_startup("imports", _import_seconds)
+    metrics.record_startup("create_app", setup_seconds)
+    logger.info("App ready: imports took %.0f ms, create_app %.0f ms", _import_seconds * 1000, setup_seconds * 1000)
+    return app
+
+
+def __getattr__(name):
+    # Module-level `app` for `gunicorn app:app` and `flask --app app`, created on first access.
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
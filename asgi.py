@@ -0,0 +1,332 @@
+"""
+Async (ASGI) serving path for the /ask and /wpg routes.
+
+Run with an ASGI server, e.g.:
+    hypercorn asgi:app --bind 0.0.0.0:5000
+Upstream calls are awaited instead of blocking a worker thread, so a single
+process can hold many in-flight Wolfram and Quezzio requests, bounded by
+ASYNC_MAX_CONCURRENCY and ASYNC_MAX_CONCURRENCY_PER_UPSTREAM.
+"""
+
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+# Load .env variables before config reads them at import time
+load_dotenv()
+
+from quart import Quart, request, jsonify, Response, send_file, url_for, session
+from quart_cors import cors
+from quart.json.provider import DefaultJSONProvider
+
+from wolfram_api_async import (
+    query_short_answer,
+    query_spoken_result,
+    query_full_results,
+    query_llm_api,
+    stream_full_results,
+    query_simple_api,
+    stream_simple_api,
+    query_pod_index,
+    query_pod,
+    WolframAPIError,
+    MODES,
+)
+from wolfram_api import FULL_RESULTS_FORMATS
+from image_store import image_store, image_key
+from batch import parse_batch_request, run_batch_async, BatchRequestError
+from models import ResultJSONMixin, SUBPOD_FIELDS
+import models
+from wpg_client import WPGError, WPGCredentialsError
+from config import QUEZZIO_URLS, METRICS_ENABLED, WPG_STORE_WARM_ON_START
+import wpg_client
+from wpg_store import wpg_store
+import metrics
+import scheduler as upstream_scheduler
+from scheduler import RateLimitedError
+from degradation import choose_mode
+
+class JSONProvider(ResultJSONMixin, DefaultJSONProvider):
+    pass
+
+
+app = Quart(__name__)
+app.json = JSONProvider(app)
+# Same secret as the Flask app, so the login session cookie it sets can be read here
+app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev_secret_key")
+app = cors(app, allow_origin="http://localhost:8080", allow_credentials=True)
+
+
+if METRICS_ENABLED:
+    # Async hooks run in the request's own task, so the timing context reaches the route.
+    @app.before_request
+    async def _start_request_timing():
+        metrics.start_request()
+
+    @app.after_request
+    async def _finish_request_timing(response):
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.finish_request(route, request.method, response.status_code, response.headers)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    async def get_metrics():
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# --- Upstream rate limiting: fair queuing per user, 429 when the queue is full ---
+
+@app.before_request
+async def _identify_user():
+    upstream_scheduler.set_current_user(upstream_scheduler.user_key(session.get("user"), request.remote_addr))
+
+
+@app.errorhandler(RateLimitedError)
+async def rate_limited(e):
+    response = jsonify({"error": str(e)})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+
+@app.route("/ask", methods=["POST"])
+async def ask():
+    data = await request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Missing JSON body"}), 400
+    question = data.get("query")
+    mode = data.get("mode")
+    if not question or not mode:
+        return jsonify({"error": "Missing 'query' or 'mode' parameter"}), 400
+
+    if mode not in MODES:
+        return jsonify({"error": f"Unsupported mode: {mode}"}), 400
+    width = data.get("width")
+    if mode == "simple" and width is not None and (not isinstance(width, int) or width <= 0):
+        return jsonify({"error": "'width' must be a positive integer"}), 400
+    fields = data.get("fields")
+    if mode == "full" and fields is not None and (not isinstance(fields, list) or any(f not in SUBPOD_FIELDS for f in fields)):
+        return jsonify({"error": f"'fields' must be a list drawn from: {', '.join(SUBPOD_FIELDS)}"}), 400
+
+    # Under upstream latency or error pressure, a cheaper mode may be served instead.
+    # Streams only fall back to plaintext-only full results, which stream the same events.
+    stream = mode == "full" and bool(data.get("stream"))
+    served, degraded = choose_mode(
+        mode, lambda: _is_cached(mode, question, width), allowed=("full_plaintext",) if stream else None
+    )
+    try:
+        if stream:
+            formats = ["plaintext"] if served == "full_plaintext" else None
+            return await _ndjson_response(stream_full_results(question, formats=formats), degraded)
+        if served == "short_answer":
+            answer = await query_short_answer(question)
+        elif served == "spoken_result":
+            answer = await query_spoken_result(question)
+        elif served == "simple":
+            return await _simple_image_response(question, width)
+        elif served == "full":
+            answer = (await query_full_results(question)).to_dict(fields)
+        elif served == "full_plaintext":
+            answer = (await query_full_results(question, formats=["plaintext"])).to_dict(fields)
+        elif served == "llm":
+            answer = await query_llm_api(question)
+        else:
+            return jsonify({"error": f"Misconfigured fallback mode: {served}"}), 500
+    except WolframAPIError as e:
+        return jsonify({"error": str(e)}), 502
+
+    if degraded is not None:
+        return jsonify({"answer": answer, "degraded": degraded})
+    return jsonify({"answer": answer})
+
+
+def _is_cached(mode, question, width=None):
+    # Mirrors the calls ask() makes for mode; see app._is_cached.
+    if mode == "simple":
+        if image_store is not None:
+            return image_store.contains(image_key(question, width))
+        return query_simple_api.is_cached(question, width=width)
+    return MODES[mode].is_cached(question)
+
+
+async def _send_stored_image(path, digest, max_age=None):
+    with metrics.phase("send_file"):
+        response = await send_file(path, mimetype="image/png", add_etags=False, cache_timeout=max_age)
+        response.set_etag(digest)
+        return response
+
+
+async def _simple_image_response(question, width=None):
+    """
+    Streams the Simple API image chunk by chunk; see app._simple_image_response.
+    """
+    if image_store is None:
+        return Response(await query_simple_api(question, width=width), mimetype="image/png")
+
+    key = image_key(question, width)
+    response = await _stored_image_response(key)
+    if response is not None:
+        return response
+
+    claim, leader = image_store.aclaim(key)
+    if not leader:
+        try:
+            await asyncio.wait_for(claim.done.wait(), image_store.claim_seconds)
+        except asyncio.TimeoutError:
+            pass
+        if claim.error is not None:
+            raise claim.error
+        response = await _stored_image_response(key)
+        if response is not None:
+            return response
+        # The other download was cut short or timed out; fetch the image ourselves.
+        claim = None
+
+    try:
+        chunks = stream_simple_api(question, width=width)
+        content_type = await chunks.__anext__()
+    except BaseException as e:
+        if claim is not None:
+            image_store.arelease(key, claim, e)
+        raise
+    return Response(image_store.atee(key, chunks, claim), mimetype=content_type)
+
+
+async def _stored_image_response(key):
+    digest, path = image_store.lookup(key)
+    if path is None:
+        return None
+    response = await _send_stored_image(path, digest)
+    response.headers["Content-Location"] = url_for("get_image", digest=digest)
+    return response
+
+
+async def _ndjson_response(events, degraded=None):
+    """
+    Streams events as newline-delimited JSON; see app._ndjson_response.
+    """
+    first = await events.__anext__()
+
+    async def generate():
+        yield _ndjson_line(first, degraded)
+        try:
+            async for event in events:
+                yield _ndjson_line(event, degraded)
+        except WolframAPIError as e:
+            yield models.dumps({"type": "error", "error": str(e)}) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+def _ndjson_line(event, degraded=None):
+    if degraded is not None and event.get("type") == "result":
+        event = dict(event, degraded=degraded)
+    return models.dumps(event) + "\n"
+
+
+@app.route("/images/<digest>", methods=["GET"])
+async def get_image(digest):
+    path = image_store.path_for(digest) if image_store is not None else None
+    if path is None:
+        return jsonify({"error": "Image not found"}), 404
+    response = await _send_stored_image(path, digest, max_age=31536000)
+    return await response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+
+
+@app.route("/ask/pods", methods=["POST"])
+async def ask_pods():
+    data = await request.get_json(silent=True) or {}
+    question = data.get("query")
+    if not question:
+        return jsonify({"error": "Missing 'query' parameter"}), 400
+
+    try:
+        return jsonify({"answer": await query_pod_index(question)})
+    except WolframAPIError as e:
+        return jsonify({"error": str(e)}), 502
+
+
+@app.route("/ask/pod", methods=["POST"])
+async def ask_pod():
+    data = await request.get_json(silent=True) or {}
+    question = data.get("query")
+    podid = data.get("podid")
+    if not question or not podid:
+        return jsonify({"error": "Missing 'query' or 'podid' parameter"}), 400
+    formats = data.get("formats")
+    if formats is not None:
+        if not isinstance(formats, list) or any(f not in FULL_RESULTS_FORMATS for f in formats):
+            return jsonify({"error": f"'formats' must be a list drawn from: {', '.join(FULL_RESULTS_FORMATS)}"}), 400
+
+    try:
+        pod = await query_pod(question, podid, podstate=data.get("podstate"), formats=formats)
+        return jsonify({"answer": pod})
+    except WolframAPIError as e:
+        return jsonify({"error": str(e)}), 502
+
+
+@app.route("/ask/batch", methods=["POST"])
+async def ask_batch():
+    try:
+        items = parse_batch_request(await request.get_json(silent=True))
+    except BatchRequestError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(await run_batch_async(items))
+
+
+# Fill the local WPG store (topic catalog and question pools) without delaying startup
+if wpg_store is not None and WPG_STORE_WARM_ON_START:
+    wpg_store.warm_in_background()
+
+
+@app.route("/wpg/topics", methods=["GET"])
+async def get_wpg_topics():
+    if wpg_store is not None:
+        hit, topics = wpg_store.get_topics()
+        metrics.mark("wpg_store", "hit" if hit else "miss")
+        if hit:
+            return jsonify(topics)
+
+    try:
+        response = await wpg_client.post_async(QUEZZIO_URLS["topics"])
+    except WPGCredentialsError as e:
+        return jsonify({"error": str(e)}), 500
+    except WPGError as e:
+        return jsonify({"error": str(e)}), 502
+
+    if response.status_code != 200:
+        return jsonify({"error": "Failed to fetch topics", "details": response.text}), 502
+
+    topics = response.json()
+    if wpg_store is not None:
+        wpg_store.put_topics(topics)
+    return jsonify(topics)
+
+
+@app.route("/wpg/questions", methods=["POST"])
+async def get_wpg_questions():
+    data = await request.get_json(silent=True) or {}
+    wpg_input = data.get("wpg_input")
+    if not wpg_input:
+        return jsonify({"error": "Missing wpg_input"}), 400
+
+    if wpg_store is not None:
+        questions = wpg_store.get_questions(wpg_input)
+        metrics.mark("wpg_store", "hit" if questions is not None else "miss")
+        if questions is not None:
+            return jsonify(questions)
+
+    try:
+        response = await wpg_client.post_async(QUEZZIO_URLS["question"], data=wpg_client.question_payload(wpg_input))
+    except WPGCredentialsError as e:
+        return jsonify({"error": str(e)}), 500
+    except WPGError as e:
+        return jsonify({"error": str(e)}), 502
+
+    if response.status_code != 200:
+        return jsonify({"error": "Failed to fetch questions", "details": response.text}), 502
+
+    questions = response.json()
+    if wpg_store is not None:
+        wpg_store.put_questions(wpg_input, questions)
+    return jsonify(questions)
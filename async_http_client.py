@@ -0,0 +1,123 @@
+import asyncio
+import contextlib
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import (
+    HTTP_POOL_MAXSIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+    ASYNC_MAX_CONCURRENCY,
+    ASYNC_MAX_CONCURRENCY_PER_UPSTREAM,
+)
+from http_client import RETRY_STATUSES
+
+
+class _LoopState:
+    """
+    Per event loop client and concurrency limits. httpx clients and asyncio
+    semaphores are bound to the loop they are first used on.
+    """
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONCURRENCY,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+        )
+        self.global_limit = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+        self.upstream_limits = {}
+        self.in_flight = {}
+
+    def limit_for(self, host):
+        limit = self.upstream_limits.get(host)
+        if limit is None:
+            limit = self.upstream_limits[host] = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY_PER_UPSTREAM)
+        return limit
+
+
+_states_lock = threading.Lock()
+_states = weakref.WeakKeyDictionary()
+
+
+def _get_state():
+    loop = asyncio.get_running_loop()
+    with _states_lock:
+        state = _states.get(loop)
+        if state is None:
+            state = _states[loop] = _LoopState()
+    return state
+
+
+async def request(method, url, **kwargs):
+    """
+    Sends a request through the current loop's shared client, bounded by the
+    global and per-upstream concurrency limits. Connection failures are
+    retried with backoff, and so are 5xx responses to GETs; read timeouts and
+    other transport errors are not, as in http_client.
+    """
+    state = _get_state()
+    host = urlsplit(url).netloc
+    idempotent = method.upper() in ("GET", "HEAD")
+    async with state.global_limit, state.limit_for(host):
+        state.in_flight[host] = state.in_flight.get(host, 0) + 1
+        try:
+            attempt = 0
+            while True:
+                try:
+                    response = await state.client.request(method, url, **kwargs)
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    if attempt >= HTTP_MAX_RETRIES:
+                        raise
+                else:
+                    if not (idempotent and response.status_code in RETRY_STATUSES and attempt < HTTP_MAX_RETRIES):
+                        return response
+                    await response.aclose()
+                await asyncio.sleep(HTTP_BACKOFF_FACTOR * (2 ** attempt))
+                attempt += 1
+        finally:
+            state.in_flight[host] -= 1
+
+
+@contextlib.asynccontextmanager
+async def stream(method, url, **kwargs):
+    """
+    Streams a response body within the same concurrency limits as request().
+    Not retried, since part of the body may already have been consumed.
+    """
+    state = _get_state()
+    host = urlsplit(url).netloc
+    async with state.global_limit, state.limit_for(host):
+        state.in_flight[host] = state.in_flight.get(host, 0) + 1
+        try:
+            async with state.client.stream(method, url, **kwargs) as response:
+                yield response
+        finally:
+            state.in_flight[host] -= 1
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
+
+
+def get_concurrency_stats():
+    """
+    Returns in-flight request counts per upstream host for the running loop.
+    """
+    state = _get_state()
+    return {
+        "max_concurrency": ASYNC_MAX_CONCURRENCY,
+        "max_concurrency_per_upstream": ASYNC_MAX_CONCURRENCY_PER_UPSTREAM,
+        "in_flight": dict(state.in_flight),
+    }
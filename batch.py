@@ -0,0 +1,121 @@
+import asyncio
+import base64
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import BATCH_MAX_ITEMS, BATCH_MAX_WORKERS
+from scheduler import RateLimitedError
+from wolfram_api import MODES, WolframAPIError
+
+
+class BatchRequestError(Exception):
+    pass
+
+
+_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="ask-batch")
+
+
+def _as_list(value, name):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return value
+    raise BatchRequestError(f"'{name}' must be a string or a list of strings")
+
+
+def parse_batch_request(data):
+    """
+    Expands a /ask/batch body into (question, mode) items. Accepts "query" or
+    "queries" together with "mode" or "modes"; every question is asked in
+    every mode. Raises BatchRequestError on invalid input.
+    """
+    if not data:
+        raise BatchRequestError("Missing JSON body")
+    if not isinstance(data, dict):
+        raise BatchRequestError("JSON body must be an object")
+    questions = _as_list(data.get("queries"), "queries") + _as_list(data.get("query"), "query")
+    modes = _as_list(data.get("modes"), "modes") + _as_list(data.get("mode"), "mode")
+    if not questions or not modes:
+        raise BatchRequestError("Missing 'query'/'queries' or 'mode'/'modes' parameter")
+    if any(not isinstance(q, str) or not q.strip() for q in questions):
+        raise BatchRequestError("Every query must be a non-empty string")
+    if any(not isinstance(m, str) for m in modes):
+        raise BatchRequestError("Every mode must be a string")
+    unsupported = [m for m in modes if m not in MODES]
+    if unsupported:
+        raise BatchRequestError(f"Unsupported mode: {unsupported[0]}")
+
+    modes = list(dict.fromkeys(modes))
+    items = [(question, mode) for question in questions for mode in modes]
+    if len(items) > BATCH_MAX_ITEMS:
+        raise BatchRequestError(f"Too many items in batch: {len(items)} (maximum {BATCH_MAX_ITEMS})")
+    return items
+
+
+def _item_result(question, mode, started, answer=None, error=None):
+    result = {
+        "query": question,
+        "mode": mode,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    if error is not None:
+        result["error"] = error
+    elif mode == "simple":
+        # Images are embedded as data URIs so the batch fits in one JSON document.
+        result["answer"] = "data:image/png;base64," + base64.b64encode(answer).decode("ascii")
+    else:
+        result["answer"] = answer
+    return result
+
+
+def _run_item(question, mode):
+    started = time.perf_counter()
+    try:
+        answer = MODES[mode](question)
+    except (WolframAPIError, RateLimitedError) as e:
+        return _item_result(question, mode, started, error=str(e))
+    return _item_result(question, mode, started, answer=answer)
+
+
+def run_batch(items):
+    """
+    Runs all (question, mode) items concurrently on the shared worker pool and
+    returns their results in request order. Per-item failures are reported in
+    the item instead of failing the whole batch.
+    """
+    started = time.perf_counter()
+    # Each item runs in a copy of the request context so its timings count toward the request.
+    futures = [
+        _executor.submit(contextvars.copy_context().run, _run_item, question, mode)
+        for question, mode in items
+    ]
+    results = [future.result() for future in futures]
+    return {
+        "results": results,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+async def run_batch_async(items):
+    """
+    asyncio counterpart of run_batch for the ASGI app.
+    """
+    from wolfram_api_async import MODES as ASYNC_MODES
+
+    async def run_item(question, mode):
+        item_started = time.perf_counter()
+        try:
+            answer = await ASYNC_MODES[mode](question)
+        except (WolframAPIError, RateLimitedError) as e:
+            return _item_result(question, mode, item_started, error=str(e))
+        return _item_result(question, mode, item_started, answer=answer)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_item(question, mode) for question, mode in items))
+    return {
+        "results": list(results),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
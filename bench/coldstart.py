@@ -0,0 +1,111 @@
+"""
+Cold start benchmark for the STEM Tutor backend.
+
+Starts a fresh backend process (pointed at bench/mock_upstream.py) several
+times and measures how long each takes from launch until it has answered its
+first /ask request, plus the startup steps the app reports on /metrics
+(module imports, create_app).
+
+Usage:
+    python bench/coldstart.py --server flask --runs 5
+    python bench/coldstart.py --server gunicorn --budget-ms 1500
+
+With --budget-ms, exits with status 1 if the median time to the first answer
+is over budget.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+from loadtest import ROOT, SERVERS, backend_env, _free_port, _wait_for_port
+
+_STARTUP_RE = re.compile(r'^process_startup_seconds\{phase="(\w+)"\} ([0-9.e-]+)$', re.MULTILINE)
+
+
+def _first_answer(base_url, timeout):
+    # Polls /ask until the server accepts connections and answers.
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            response = requests.post(f"{base_url}/ask", json={"query": "2+2", "mode": "short_answer"}, timeout=timeout)
+            if response.status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"No answer from {base_url} after {timeout}s")
+
+
+def _startup_steps(base_url):
+    try:
+        text = requests.get(f"{base_url}/metrics", timeout=5).text
+    except requests.RequestException:
+        return {}
+    return {phase: float(seconds) * 1000 for phase, seconds in _STARTUP_RE.findall(text)}
+
+
+def run_once(server, mock_port, workers, timeout):
+    app_port = _free_port()
+    command = [part.format(port=app_port, workers=workers) for part in SERVERS[server]]
+    env = backend_env(mock_port, WOLFRAM_CACHE_ENABLED="0")
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{app_port}"
+        _first_answer(base_url, timeout)
+        row = {"first_answer_ms": round((time.perf_counter() - started) * 1000, 1)}
+        row.update({f"{phase}_ms": round(ms, 1) for phase, ms in _startup_steps(base_url).items()})
+        return row
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=sorted(SERVERS), default="flask")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument("--timeout", type=float, default=30.0, help="give up on a run after this many seconds")
+    parser.add_argument("--budget-ms", type=float, help="fail if the median time to the first answer exceeds this")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mock_port = _free_port()
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "bench", "mock_upstream.py"), "--port", str(mock_port), "--latency-ms", "0", "--jitter-ms", "0"],
+        stdout=subprocess.DEVNULL,
+    )
+    rows = []
+    try:
+        _wait_for_port(mock_port)
+        for run in range(1, args.runs + 1):
+            row = run_once(args.server, mock_port, args.workers, args.timeout)
+            rows.append(row)
+            steps = ", ".join(f"{name[:-3]} {ms:.0f} ms" for name, ms in row.items() if name != "first_answer_ms")
+            print(f"run {run}: first answer after {row['first_answer_ms']:.0f} ms" + (f" ({steps})" if steps else ""))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    median = statistics.median(row["first_answer_ms"] for row in rows)
+    print(f"server={args.server} runs={args.runs} median first answer {median:.0f} ms")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"settings": vars(args), "median_first_answer_ms": median, "runs": rows}, f, indent=2)
+    if args.budget_ms is not None and median > args.budget_ms:
+        sys.exit(f"Median cold start {median:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
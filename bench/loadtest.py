@@ -0,0 +1,311 @@
+"""
+Offline load test for the STEM Tutor backend.
+
+Starts bench/mock_upstream.py and the backend (Flask dev server, gunicorn or
+the ASGI app under hypercorn) pointed at it, then drives mixed /ask and /wpg
+traffic and reports p50/p95/p99 latency, requests per second, errors and
+server memory (RSS) for each mode.
+
+Usage:
+    python bench/loadtest.py --server flask --concurrency 32 --duration 20
+    python bench/loadtest.py --server hypercorn --mix short_answer=5,full=2,simple=1
+    python bench/loadtest.py --json results.json
+
+Every phase runs one mode on its own so per-mode latency and memory are
+isolated, followed by a "mixed" phase using --mix weights.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (method, path, body builder)
+SCENARIOS = {
+    "short_answer": ("POST", "/ask", lambda q: {"query": q, "mode": "short_answer"}),
+    "spoken_result": ("POST", "/ask", lambda q: {"query": q, "mode": "spoken_result"}),
+    "llm": ("POST", "/ask", lambda q: {"query": q, "mode": "llm"}),
+    "full": ("POST", "/ask", lambda q: {"query": q, "mode": "full"}),
+    "full_stream": ("POST", "/ask", lambda q: {"query": q, "mode": "full", "stream": True}),
+    "simple": ("POST", "/ask", lambda q: {"query": q, "mode": "simple"}),
+    "pods": ("POST", "/ask/pods", lambda q: {"query": q}),
+    "batch": ("POST", "/ask/batch", lambda q: {"query": q, "modes": ["short_answer", "full", "llm"]}),
+    "wpg_topics": ("GET", "/wpg/topics", None),
+    "wpg_questions": ("POST", "/wpg/questions", lambda q: {"wpg_input": [
+        {"wpg_topic": f"Topic {len(q) % 10}.{len(q) % 20}", "wpg_instances": 5,
+         "wpg_difficulty": "Beginner", "wpg_answer_type": "Single Expression"}
+    ]}),
+}
+
+DEFAULT_MIX = "short_answer=4,full=2,simple=1,llm=1,wpg_topics=1,wpg_questions=1"
+
+SERVERS = {
+    "flask": [sys.executable, "-m", "flask", "--app", "app", "run", "--host", "127.0.0.1", "--port", "{port}", "--with-threads"],
+    "gunicorn": ["gunicorn", "-w", "{workers}", "-k", "gthread", "--threads", "8", "-b", "127.0.0.1:{port}", "app:app"],
+    "hypercorn": ["hypercorn", "asgi:app", "--bind", "127.0.0.1:{port}"],
+}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def backend_env(mock_port, **overrides):
+    """
+    Environment for a backend process pointed at the mock upstream on mock_port,
+    with the on-disk stores off so every run starts from the same state.
+    """
+    return dict(
+        os.environ,
+        WOLFRAM_APPID="bench",
+        WOLFRAM_API_BASE_URL=f"http://127.0.0.1:{mock_port}",
+        QUEZZIO_BASE_URL=f"http://127.0.0.1:{mock_port}/api/quezzio",
+        WPG_CLIENT_ID="bench",
+        WPG_CLIENT_SECRET="bench",
+        IMAGE_STORE_DIR="",
+        WPG_STORE_PATH="",
+        **overrides,
+    )
+
+
+def _wait_for_port(port, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def _rss_kb(pid):
+    """
+    Resident memory of a process and its children, in KiB (Linux /proc only).
+    """
+    pids = {pid}
+    try:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                            pids.add(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+    except OSError:
+        return None
+    total = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+
+class MemorySampler:
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _rss_kb(self.pid)
+            if rss:
+                self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _questions(count, seed):
+    rng = random.Random(seed)
+    templates = ["derivative of x^{n}", "solve x^2 = {n}", "integrate sin({n}x)", "{n} mph to km/h", "factor x^{n} - 1"]
+    return [rng.choice(templates).format(n=i + 2) for i in range(count)]
+
+
+_local = threading.local()
+
+
+def _session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _one_request(base_url, scenario, question, timeout):
+    method, path, build = SCENARIOS[scenario]
+    started = time.perf_counter()
+    try:
+        response = _session().request(
+            method, base_url + path, json=build(question) if build else None, timeout=timeout
+        )
+        size = len(response.content)
+        ok = response.status_code < 400
+    except requests.RequestException:
+        size, ok = 0, False
+    return scenario, time.perf_counter() - started, ok, size
+
+
+def run_phase(name, base_url, weights, questions, args, server_pid):
+    scenarios = list(weights)
+    scenario_weights = [weights[s] for s in scenarios]
+    rng = random.Random(args.seed)
+    deadline = time.perf_counter() + args.duration
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        local_rng = random.Random(rng.random())
+        while time.perf_counter() < deadline:
+            scenario = local_rng.choices(scenarios, weights=scenario_weights)[0]
+            outcome = _one_request(base_url, scenario, local_rng.choice(questions), args.timeout)
+            with lock:
+                results.append(outcome)
+
+    rss_before = _rss_kb(server_pid)
+    started = time.perf_counter()
+    with MemorySampler(server_pid) as sampler:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for _ in range(args.concurrency):
+                pool.submit(worker)
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(r[1] * 1000 for r in results if r[2])
+    return {
+        "phase": name,
+        "requests": len(results),
+        "errors": sum(1 for r in results if not r[2]),
+        "rps": round(len(results) / elapsed, 1) if elapsed else 0,
+        "p50_ms": _round(_percentile(latencies, 50)),
+        "p95_ms": _round(_percentile(latencies, 95)),
+        "p99_ms": _round(_percentile(latencies, 99)),
+        "mean_bytes": int(sum(r[3] for r in results) / len(results)) if results else 0,
+        "rss_before_mb": _mb(rss_before),
+        "rss_peak_mb": _mb(sampler.peak),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+def _mb(kb):
+    return None if not kb else round(kb / 1024.0, 1)
+
+
+def _parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario in --mix: {name} (choose from {', '.join(SCENARIOS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def _print_table(rows):
+    columns = ["phase", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "mean_bytes", "rss_peak_mb"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=sorted(SERVERS), default="flask")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights for the mixed phase")
+    parser.add_argument("--phases", default=None, help="comma-separated single-scenario phases (default: those in --mix)")
+    parser.add_argument("--unique-questions", type=int, default=200, help="size of the question pool")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-cache", action="store_true", help="disable the backend response cache")
+    parser.add_argument("--wpg-store", help="use this WPG store file (default: disabled, every call goes upstream)")
+    parser.add_argument("--rate-limit", default="0", help="WOLFRAM_RATE_LIMIT for the backend (default: 0, no scheduler)")
+    parser.add_argument("--json", dest="json_path", help="also write results to this file")
+    parser.add_argument("--mock-arg", action="append", default=[], help="extra argument for mock_upstream.py (repeatable), e.g. --mock-arg=--latency-ms=300")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mix = _parse_mix(args.mix)
+    phases = args.phases.split(",") if args.phases else list(mix)
+    questions = _questions(args.unique_questions, args.seed)
+
+    mock_port, app_port = _free_port(), _free_port()
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "bench", "mock_upstream.py"), "--port", str(mock_port)] + args.mock_arg,
+        stdout=subprocess.DEVNULL,
+    )
+    env = backend_env(mock_port, WOLFRAM_RATE_LIMIT=args.rate_limit)
+    if args.no_cache:
+        env["WOLFRAM_CACHE_ENABLED"] = "0"
+    if args.wpg_store:
+        env["WPG_STORE_PATH"] = args.wpg_store
+    command = [part.format(port=app_port, workers=args.workers) for part in SERVERS[args.server]]
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    rows = []
+    try:
+        _wait_for_port(mock_port)
+        _wait_for_port(app_port)
+        base_url = f"http://127.0.0.1:{app_port}"
+        for phase in phases:
+            if phase not in SCENARIOS:
+                raise SystemExit(f"Unknown phase: {phase}")
+            rows.append(run_phase(phase, base_url, {phase: 1.0}, questions, args, server.pid))
+        rows.append(run_phase("mixed", base_url, mix, questions, args, server.pid))
+    finally:
+        server.terminate()
+        mock.terminate()
+        server.wait()
+        mock.wait()
+
+    print(f"server={args.server} concurrency={args.concurrency} duration={args.duration}s per phase "
+          f"questions={args.unique_questions} cache={'off' if args.no_cache else 'on'}")
+    _print_table(rows)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"settings": vars(args), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
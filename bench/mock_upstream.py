@@ -0,0 +1,247 @@
+"""
+Local stand-in for the Wolfram|Alpha and Quezzio (WPG) APIs, for benchmarking
+app.py / asgi.py without touching the real metered endpoints.
+
+Serves the paths of the five endpoints in config.WOLFRAM_API_URLS plus the
+Quezzio token, topics and question endpoints, with configurable latency,
+payload sizes and error rate. Point the backend at it with:
+
+    WOLFRAM_API_BASE_URL=http://127.0.0.1:8900
+    QUEZZIO_BASE_URL=http://127.0.0.1:8900/api/quezzio
+
+Usage:
+    python bench/mock_upstream.py --port 8900 --latency-ms 150 --jitter-ms 50
+    python bench/mock_upstream.py --endpoint-latency-ms full_results=3000 --endpoint-error-rate simple=1
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def _png(size):
+    """
+    Returns a valid grayscale PNG of roughly the requested byte size.
+    """
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    width = 256
+    height = max(size // width, 1)
+    # Random pixels keep the compressed size close to the raw size.
+    raw = b"".join(b"\x00" + os.urandom(width) for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+class Settings:
+    def __init__(self, args):
+        self.latency = args.latency_ms / 1000.0
+        self.jitter = args.jitter_ms / 1000.0
+        self.error_rate = args.error_rate
+        # Per-endpoint overrides (full_results, result, spoken, simple, llm-api, token, topics, question)
+        self.endpoint_latency = {name: float(ms) / 1000.0 for name, ms in args.endpoint_latency_ms}
+        self.endpoint_error_rate = {name: float(rate) for name, rate in args.endpoint_error_rate}
+        self.pods = args.pods
+        self.pod_bytes = args.pod_bytes
+        self.image = _png(args.image_bytes)
+        self.token_ttl = args.token_ttl
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def _full_results(question, settings, formats, includepodid):
+    filler = "x" * max(settings.pod_bytes // 3, 1)
+    pods = []
+    for i in range(settings.pods):
+        pod_id = "Result" if i == 1 else ("Input" if i == 0 else f"Pod{i}")
+        if includepodid and pod_id not in includepodid:
+            continue
+        sub = {"title": ""}
+        if "plaintext" in formats:
+            sub["plaintext"] = f"{question} -> answer {i}"
+        if "image" in formats:
+            sub["img"] = {"src": f"https://example.invalid/{i}.gif?{filler}", "alt": "plot", "width": 300, "height": 200}
+        if "mathml" in formats:
+            sub["mathml"] = f"<math><mi>{filler}</mi></math>"
+        if "minput" in formats:
+            sub["minput"] = f"Solve[{question}]"
+        if "moutput" in formats:
+            sub["moutput"] = filler
+        pods.append({
+            "title": pod_id,
+            "id": pod_id,
+            "primary": pod_id == "Result",
+            "scanner": "Simplification",
+            "position": 100 * (i + 1),
+            "subpods": [sub],
+            "states": [{"name": "Step-by-step solution", "input": f"{pod_id}__Step-by-step solution"}],
+        })
+    return {
+        "queryresult": {
+            "success": True,
+            "error": False,
+            "numpods": len(pods),
+            "datatypes": "Math",
+            "timedout": "",
+            "pods": pods,
+            "assumptions": {"type": "Clash", "word": question[:10], "count": 2},
+        }
+    }
+
+
+def _questions(wpg_input):
+    # One list of generated questions per wpg_input entry, like Quezzio.
+    result = []
+    for entry in wpg_input if isinstance(wpg_input, list) else [wpg_input]:
+        count = entry.get("wpg_instances", 1) if isinstance(entry, dict) else 1
+        topic = entry.get("wpg_topic", "") if isinstance(entry, dict) else ""
+        difficulty = entry.get("wpg_difficulty", "") if isinstance(entry, dict) else ""
+        result.append([
+            {
+                "wpg_topic": topic,
+                "wpg_difficulty": difficulty,
+                "wpg_instance": f"<math><mn>{n}</mn><mo>+</mo><mn>{n}</mn></math>",
+                "wpg_instance_steps_command": "",
+                "wpg_instance_answers": [{"MathematicaSolution": [str(2 * n)]}],
+            }
+            for n in (random.randint(1, 99) for _ in range(count))
+        ])
+    return result
+
+
+def make_handler(settings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type="text/plain;charset=utf-8"):
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _delay_and_fail(self, name):
+            settings.count(name)
+            latency = settings.endpoint_latency.get(name, settings.latency)
+            time.sleep(max(latency + random.uniform(-settings.jitter, settings.jitter), 0))
+            error_rate = settings.endpoint_error_rate.get(name, settings.error_rate)
+            if error_rate and random.random() < error_rate:
+                self._send(503, "Service Unavailable")
+                return True
+            return False
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            question = (query.get("i") or query.get("input") or [""])[0]
+            path = url.path
+
+            if path == "/v2/query":
+                if self._delay_and_fail("full_results"):
+                    return
+                formats = set(",".join(query.get("format", ["plaintext"])).split(","))
+                body = _full_results(question, settings, formats, query.get("includepodid"))
+                self._send(200, json.dumps(body), "application/json")
+            elif path in ("/v1/result", "/v1/spoken", "/api/v1/llm-api"):
+                if self._delay_and_fail(path.rsplit("/", 1)[-1]):
+                    return
+                self._send(200, f"The answer to {question} is 2")
+            elif path == "/v1/simple":
+                if self._delay_and_fail("simple"):
+                    return
+                self._send(200, settings.image, "image/png")
+            elif path == "/__stats":
+                with settings.lock:
+                    self._send(200, json.dumps(settings.counts), "application/json")
+            else:
+                self._send(404, "Not found")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            form = parse_qs(self.rfile.read(length).decode("utf-8"))
+            path = urlsplit(self.path).path
+
+            if path == "/api/quezzio/token":
+                if self._delay_and_fail("token"):
+                    return
+                body = {"access_token": f"mock-{time.time()}", "expires_in": settings.token_ttl}
+                self._send(200, json.dumps(body), "application/json")
+            elif path == "/api/quezzio/wpg/metadata/topics":
+                if self._delay_and_fail("topics"):
+                    return
+                topics = {f"Subject {s}": [f"Topic {s}.{t}" for t in range(20)] for s in range(10)}
+                self._send(200, json.dumps(topics), "application/json")
+            elif path == "/api/quezzio/wpg/question":
+                if self._delay_and_fail("question"):
+                    return
+                try:
+                    wpg_input = json.loads(form["wpg_input"][0])
+                except (KeyError, ValueError):
+                    self._send(400, "Missing wpg_input")
+                    return
+                self._send(200, json.dumps(_questions(wpg_input)), "application/json")
+            else:
+                self._send(404, "Not found")
+
+    return Handler
+
+
+def _pair(value):
+    name, sep, number = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {value!r}")
+    return name, float(number)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="mean upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="uniform +/- jitter around the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--endpoint-latency-ms", type=_pair, action="append", default=[], metavar="NAME=MS",
+                        help="mean latency of one endpoint (repeatable), e.g. full_results=3000")
+    parser.add_argument("--endpoint-error-rate", type=_pair, action="append", default=[], metavar="NAME=RATE",
+                        help="error rate of one endpoint (repeatable), e.g. simple=1")
+    parser.add_argument("--pods", type=int, default=6, help="pods per Full Results response")
+    parser.add_argument("--pod-bytes", type=int, default=8000, help="approximate payload bytes per pod")
+    parser.add_argument("--image-bytes", type=int, default=60000, help="approximate Simple API PNG size")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="expires_in of issued WPG tokens")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(Settings(args)))
+    server.daemon_threads = True
+    print(f"Mock upstream listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
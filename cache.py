@@ -0,0 +1,320 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    WOLFRAM_CACHE_ENABLED,
+    WOLFRAM_CACHE_MAX_BYTES,
+    WOLFRAM_CACHE_DB,
+    WOLFRAM_CACHE_DB_MAX_BYTES,
+    WOLFRAM_CACHE_TTLS,
+)
+from models import Pod, QueryResult, Subpod
+from query_index import canonicalize, query_index
+
+
+def normalize_question(question):
+    """
+    Canonicalizes a question for use in a cache key (see query_index.canonicalize),
+    then maps it onto an earlier question asking the same thing, if the
+    similarity index is enabled.
+    """
+    canonical = canonicalize(question)
+    if query_index is not None:
+        return query_index.resolve(canonical)
+    return canonical
+
+
+def _normalize_value(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sorted(str(v).strip() for v in value)
+    return value
+
+
+def make_key(mode, arguments):
+    """
+    Builds a stable cache key from the answer mode and the query arguments
+    (question, units, formats, pod filters, ...). Unset arguments are ignored.
+    """
+    parts = {"mode": mode}
+    for name, value in arguments.items():
+        if value is None:
+            continue
+        if name == "question":
+            parts[name] = normalize_question(value)
+        else:
+            parts[name] = _normalize_value(value)
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _encode(value):
+    """
+    Returns (kind, payload bytes) for a cacheable value.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return "bytes", bytes(value)
+    if isinstance(value, str):
+        return "text", value.encode("utf-8")
+    if isinstance(value, QueryResult):
+        return "query_result", json.dumps(value.to_dict(), separators=(",", ":")).encode("utf-8")
+    return "json", json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def _approx_size(value):
+    """
+    Rough encoded size of a cacheable value, for the memory tier's byte
+    budget: the lengths of its strings plus a little per field and item,
+    without serializing it.
+    """
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(name) + _approx_size(item) + 4 for name, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_approx_size(item) + 1 for item in value)
+    if isinstance(value, (QueryResult, Pod, Subpod)):
+        return sum(
+            len(name) + _approx_size(getattr(value, name)) + 4
+            for name in value.__slots__ if getattr(value, name) is not None
+        )
+    return 8
+
+
+def _decode(kind, payload):
+    if kind == "bytes":
+        return bytes(payload)
+    if kind == "text":
+        return bytes(payload).decode("utf-8")
+    if kind == "query_result":
+        return QueryResult.from_api(json.loads(bytes(payload).decode("utf-8")))
+    return json.loads(bytes(payload).decode("utf-8"))
+
+
+class _DiskStore:
+    """
+    SQLite-backed second tier that survives process restarts. Every
+    MAINTENANCE_INTERVAL seconds, and as soon as this process's writes take
+    the payloads over max_bytes, expired rows are deleted and, if the
+    payloads still take more than max_bytes, the rows closest to expiry are
+    evicted until they are back under 90% of it. The file may be shared by
+    several workers; each recounts the total when it does maintenance.
+    """
+
+    MAINTENANCE_INTERVAL = 60
+
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " mode TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            self._conn.commit()
+            self._maintain(time.time())
+
+    def get(self, key, now):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mode, kind, value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[3] <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return row
+
+    def set(self, key, mode, kind, payload, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, mode, kind, value, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, mode, kind, payload, expires_at),
+            )
+            self._conn.commit()
+            self._bytes += len(payload)
+            now = time.time()
+            if now - self._maintained_at >= self.MAINTENANCE_INTERVAL or self._bytes > self.max_bytes:
+                self._maintain(now)
+
+    def _maintain(self, now):
+        # Expects self._lock to be held.
+        self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(length(value)), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            evicted = []
+            rows = self._conn.execute("SELECT key, length(value) FROM responses ORDER BY expires_at")
+            for key, size in rows:
+                if total <= self.max_bytes * 0.9:
+                    break
+                evicted.append((key,))
+                total -= size
+            rows.close()
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+        self._conn.commit()
+        self._maintained_at = now
+        self._bytes = total
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: an in-process LRU bounded by total payload bytes
+    (estimated unless the value is also encoded for the disk tier), optionally
+    backed by a SQLite file. Entries expire after a per-mode TTL; a TTL of 0
+    disables caching for that mode.
+    """
+
+    def __init__(self, max_bytes, ttls, db_path=None, enabled=True, disk_max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttls = dict(ttls)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (mode, value, size, expires_at)
+        self._bytes = 0
+        self._disk = _DiskStore(db_path, disk_max_bytes) if (enabled and db_path) else None
+        self._stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+
+    def ttl_for(self, mode):
+        return self.ttls.get(mode, 0) if self.enabled else 0
+
+    def get(self, key, mode, count=True):
+        """
+        Returns (True, value) on a hit and (False, None) on a miss. With
+        count=False the lookup is left out of the hit and miss stats, for
+        re-checks of a key that was already counted.
+        """
+        if not self.ttl_for(mode):
+            return False, None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[3] > now:
+                    self._entries.move_to_end(key)
+                    if count:
+                        self._stats["hits"] += 1
+                        self._stats["memory_hits"] += 1
+                    return True, entry[1]
+                self._remove(key)
+                self._stats["expirations"] += 1
+
+        if self._disk is not None:
+            row = self._disk.get(key, now)
+            if row is not None:
+                row_mode, kind, payload, expires_at = row
+                value = _decode(kind, payload)
+                with self._lock:
+                    self._insert(key, row_mode, value, len(payload), expires_at)
+                    if count:
+                        self._stats["hits"] += 1
+                        self._stats["disk_hits"] += 1
+                return True, value
+
+        if count:
+            with self._lock:
+                self._stats["misses"] += 1
+        return False, None
+
+    def contains(self, key, mode):
+        """
+        Whether key has an unexpired entry, without counting a hit or miss.
+        """
+        if not self.ttl_for(mode):
+            return False
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] > now:
+                return True
+        return self._disk is not None and self._disk.get(key, now) is not None
+
+    def set(self, key, mode, value):
+        ttl = self.ttl_for(mode)
+        if not ttl:
+            return
+        expires_at = time.time() + ttl
+        # Values are only serialized for the disk tier; the memory tier goes by an estimate.
+        if self._disk is not None:
+            kind, payload = _encode(value)
+            size = len(payload)
+        else:
+            size = _approx_size(value)
+        with self._lock:
+            self._insert(key, mode, value, size, expires_at)
+            self._stats["stores"] += 1
+        if self._disk is not None:
+            self._disk.set(key, mode, kind, payload, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        stats["max_bytes"] = self.max_bytes
+        stats["disk"] = self._disk is not None
+        stats["disk_evictions"] = self._disk.evictions if self._disk is not None else 0
+        return stats
+
+    # The helpers below expect self._lock to be held.
+
+    def _insert(self, key, mode, value, size, expires_at):
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            # Too large for the memory tier; the disk tier (if any) still keeps it.
+            return
+        self._entries[key] = (mode, value, size, expires_at)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+
+
+response_cache = ResponseCache(
+    max_bytes=WOLFRAM_CACHE_MAX_BYTES,
+    ttls=WOLFRAM_CACHE_TTLS,
+    db_path=WOLFRAM_CACHE_DB,
+    enabled=WOLFRAM_CACHE_ENABLED,
+    disk_max_bytes=WOLFRAM_CACHE_DB_MAX_BYTES,
+)
@@ -1,4 +1,15 @@
 import os
+from urllib.parse import urlsplit
+
+
+def _mapping(name, default):
+    # "a=1,b=2" -> {"a": "1", "b": "2"}
+    return {
+        key.strip(): value.strip()
+        for key, _, value in (item.partition("=") for item in os.getenv(name, default).split(","))
+        if key.strip()
+    }
+
 
 WOLFRAM_API_URLS = {
     "full_results": "http://api.wolframalpha.com/v2/query",
@@ -8,4 +19,135 @@ WOLFRAM_API_URLS = {
     "llm": "https://www.wolframalpha.com/api/v1/llm-api",
 }
 
-WOLFRAM_APPID = os.getenv("WOLFRAM_APPID")
\ No newline at end of file
+# Point every Wolfram endpoint at another host (e.g. the local stand-in in bench/), keeping the paths
+WOLFRAM_API_BASE_URL = os.getenv("WOLFRAM_API_BASE_URL")
+if WOLFRAM_API_BASE_URL:
+    WOLFRAM_API_URLS = {
+        name: WOLFRAM_API_BASE_URL.rstrip("/") + urlsplit(url).path
+        for name, url in WOLFRAM_API_URLS.items()
+    }
+
+WOLFRAM_APPID = os.getenv("WOLFRAM_APPID")
+
+# Shared HTTP client: connection pooling, timeouts (seconds) and retries
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# Retries per upstream call, for connection failures and 5xx responses only (never read timeouts)
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.3"))
+
+# Wolfram response cache: in-memory LRU bounded by bytes, optional SQLite tier,
+# per-mode TTLs in seconds (0 disables caching for that mode)
+WOLFRAM_CACHE_ENABLED = os.getenv("WOLFRAM_CACHE_ENABLED", "1") != "0"
+WOLFRAM_CACHE_MAX_BYTES = int(os.getenv("WOLFRAM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+WOLFRAM_CACHE_DB = os.getenv("WOLFRAM_CACHE_DB")  # e.g. "wolfram_cache.sqlite3"; unset keeps the cache in memory only
+# Payload bytes kept in the SQLite tier; the entries closest to expiry are evicted beyond it
+WOLFRAM_CACHE_DB_MAX_BYTES = int(os.getenv("WOLFRAM_CACHE_DB_MAX_BYTES", str(512 * 1024 * 1024)))
+WOLFRAM_CACHE_TTLS = {
+    mode: int(os.getenv(f"WOLFRAM_CACHE_TTL_{mode.upper()}", "3600"))
+    for mode in ("short_answer", "spoken_result", "simple", "full", "llm")
+}
+
+# Quezzio / Wolfram Problem Generator (WPG) endpoints
+QUEZZIO_BASE_URL = os.getenv("QUEZZIO_BASE_URL", "https://quezzio.techconsulting.wolfram.com/api/quezzio")
+QUEZZIO_URLS = {
+    "token": f"{QUEZZIO_BASE_URL}/token",
+    "topics": f"{QUEZZIO_BASE_URL}/wpg/metadata/topics",
+    "question": f"{QUEZZIO_BASE_URL}/wpg/question",
+}
+
+# Seconds before expiry at which the cached WPG access token is refreshed in the background
+WPG_TOKEN_REFRESH_MARGIN = int(os.getenv("WPG_TOKEN_REFRESH_MARGIN", "60"))
+# Lifetime assumed when the token endpoint does not return expires_in
+WPG_TOKEN_DEFAULT_TTL = int(os.getenv("WPG_TOKEN_DEFAULT_TTL", "300"))
+
+# Async (ASGI) serving path: upper bounds on in-flight upstream requests,
+# across all upstreams and per upstream host
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "500"))
+ASYNC_MAX_CONCURRENCY_PER_UPSTREAM = int(os.getenv("ASYNC_MAX_CONCURRENCY_PER_UPSTREAM", "200"))
+
+# /ask/batch: maximum (question, mode) items per request and worker threads used to run them
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "16"))
+
+# Chunk size in bytes for streamed upstream bodies
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "8192"))
+
+# Content-addressed on-disk store for Simple API images, e.g. "image_store"; unset keeps it disabled
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "")
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Losslessly re-compress stored PNGs (requires Pillow)
+IMAGE_STORE_REENCODE = os.getenv("IMAGE_STORE_REENCODE", "0") == "1"
+
+# Instrumentation: Server-Timing headers and the /metrics endpoint
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# Sampling profiler for slow requests: requests slower than PROFILE_SLOW_REQUEST_MS (0 disables it)
+# have their sampled stacks written to PROFILE_DIR in collapsed ("folded") flame graph format
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Local precomputed store for the WPG topic catalog and generated question pools
+# (set WPG_STORE_PATH to an empty value to disable it and always call Quezzio)
+WPG_STORE_PATH = os.getenv("WPG_STORE_PATH", "wpg_store.json")
+# Seconds before stored topics / question pools are refreshed in the background (stale entries are still served)
+WPG_TOPICS_TTL = int(os.getenv("WPG_TOPICS_TTL", str(24 * 3600)))
+WPG_QUESTIONS_TTL = int(os.getenv("WPG_QUESTIONS_TTL", str(7 * 24 * 3600)))
+# Generated questions kept per (topic, difficulty, answer type)
+WPG_POOL_SIZE = int(os.getenv("WPG_POOL_SIZE", "20"))
+# Run the warm-up job (topic catalog and every question pool) in the background at startup
+WPG_STORE_WARM_ON_START = os.getenv("WPG_STORE_WARM_ON_START", "0") == "1"
+
+# Query deduplication: questions whose canonical forms are at least this similar (0-1) share cached
+# answers. Off (0) by default: only identical canonical forms share answers unless this is opted into.
+QUERY_SIMILARITY_THRESHOLD = float(os.getenv("QUERY_SIMILARITY_THRESHOLD", "0"))
+QUERY_INDEX_MAX_ENTRIES = int(os.getenv("QUERY_INDEX_MAX_ENTRIES", "50000"))
+# JSON-lines audit log of every question merged onto another (empty to disable)
+QUERY_MERGE_LOG = os.getenv("QUERY_MERGE_LOG", "query_merges.jsonl")
+
+# Google sign-in: the OpenID discovery document is cached in OAUTH_METADATA_CACHE (empty disables
+# the file) for OAUTH_METADATA_TTL seconds instead of being fetched by every worker
+GOOGLE_METADATA_URL = "https://accounts.google.com/.well-known/openid-configuration"
+OAUTH_METADATA_CACHE = os.getenv("OAUTH_METADATA_CACHE", "oauth_metadata.json")
+OAUTH_METADATA_TTL = int(os.getenv("OAUTH_METADATA_TTL", "86400"))
+
+# Upstream scheduler in front of the Wolfram|Alpha API (shared AppID quota).
+# Requests per second and burst size of the token bucket; a rate of 0 disables the scheduler.
+# The bucket is per worker process: with N workers, set both to the AppID limit divided by N.
+WOLFRAM_RATE_LIMIT = float(os.getenv("WOLFRAM_RATE_LIMIT", "10"))
+WOLFRAM_RATE_BURST = int(os.getenv("WOLFRAM_RATE_BURST", "20"))
+# Requests allowed to wait for a token, and for how long (seconds), before being rejected with 429
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "200"))
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "15"))
+# Priority per answer mode (lower is served first), e.g. "short_answer=0,full=2"
+SCHEDULER_PRIORITIES = {
+    mode: int(priority)
+    for mode, priority in _mapping("SCHEDULER_PRIORITIES", "short_answer=0,spoken_result=0,llm=1,full=2,simple=2").items()
+}
+
+# Adaptive degradation: per upstream endpoint, rolling latency and error rates over the last
+# DEGRADE_WINDOW seconds (judged once there are DEGRADE_MIN_SAMPLES calls). 0 disables it.
+DEGRADE_WINDOW = float(os.getenv("DEGRADE_WINDOW", "60"))
+DEGRADE_MIN_SAMPLES = int(os.getenv("DEGRADE_MIN_SAMPLES", "10"))
+# p95 latency budget per endpoint, in seconds; full_plaintext is the Full Results API asked for plaintext only
+DEGRADE_LATENCY_BUDGETS = {
+    endpoint: float(seconds)
+    for endpoint, seconds in _mapping(
+        "DEGRADE_LATENCY_BUDGETS", "short_answer=3,spoken_result=3,llm=5,full=6,full_plaintext=4,simple=6"
+    ).items()
+}
+# Cheaper modes /ask falls back to, in order, when the requested one is over budget or its circuit is open.
+# The defaults keep the shape of the answer (pods stay pods, text stays text); falling back from full or
+# simple to a text mode changes it, and clients then have to render by degraded.mode.
+DEGRADE_FALLBACKS = {
+    mode: [fallback for fallback in chain.split("|") if fallback]
+    for mode, chain in _mapping(
+        "DEGRADE_FALLBACKS", "full=full_plaintext,llm=short_answer,spoken_result=short_answer"
+    ).items()
+}
+# Circuit breaker: an endpoint failing at least this share of calls is not called for CIRCUIT_OPEN_SECONDS,
+# then a single probe call decides whether it is back
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
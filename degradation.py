@@ -0,0 +1,242 @@
+import threading
+import time
+from collections import deque
+
+import metrics
+
+from config import (
+    DEGRADE_WINDOW,
+    DEGRADE_MIN_SAMPLES,
+    DEGRADE_LATENCY_BUDGETS,
+    DEGRADE_FALLBACKS,
+    CIRCUIT_ERROR_RATE,
+    CIRCUIT_OPEN_SECONDS,
+)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Calls kept per endpoint, whatever the window
+_MAX_SAMPLES = 1024
+
+
+def is_failure(status):
+    """
+    Whether an upstream call outcome counts against its endpoint: timeouts,
+    connection errors and 5xx responses. 501 is how the Short Answers and
+    Spoken Results APIs say they have no answer, which is not an outage.
+    """
+    if isinstance(status, int):
+        return status >= 500 and status != 501
+    return True
+
+
+class _Endpoint:
+    __slots__ = ("samples", "state", "opened_at", "probing", "p95", "p95_at")
+
+    def __init__(self):
+        self.samples = deque(maxlen=_MAX_SAMPLES)  # (finished at, seconds, failed)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.p95 = None
+        self.p95_at = 0.0
+
+
+class DegradationPolicy:
+    """
+    Tracks rolling latency and error rates per upstream endpoint and decides
+    which mode /ask serves. An endpoint whose p95 latency over the window
+    exceeds its budget is skipped in favour of the next cheaper mode in its
+    fallback chain. An endpoint failing at least error_rate of its calls has
+    its circuit opened: it is not called at all for open_seconds, after which
+    one probe call closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, window, min_samples, budgets, fallbacks, error_rate, open_seconds):
+        self.window = window
+        self.min_samples = min_samples
+        self.budgets = dict(budgets)
+        self.fallbacks = {mode: list(chain) for mode, chain in fallbacks.items()}
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._stats = {"degraded": {}, "circuit_opened": 0, "rejected": 0}
+
+    def _endpoint(self, name):
+        endpoint = self._endpoints.get(name)
+        if endpoint is None:
+            endpoint = self._endpoints[name] = _Endpoint()
+        return endpoint
+
+    def _trim(self, endpoint, now):
+        samples = endpoint.samples
+        while samples and samples[0][0] < now - self.window:
+            samples.popleft()
+
+    # --- circuit breaker ---
+
+    def _circuit_allows(self, endpoint, now):
+        if endpoint.state == OPEN and now - endpoint.opened_at >= self.open_seconds:
+            endpoint.state = HALF_OPEN
+            endpoint.probing = False
+        if endpoint.state == HALF_OPEN:
+            # A probe that never reported back (e.g. its worker died) does not block forever.
+            return not endpoint.probing or now - endpoint.opened_at >= 2 * self.open_seconds
+        return endpoint.state == CLOSED
+
+    def allow(self, name):
+        """
+        Called before each upstream call to endpoint name. Returns False while
+        its circuit is open; in the half-open state, lets one probe call through.
+        """
+        now = time.monotonic()
+        with self._lock:
+            endpoint = self._endpoint(name)
+            if not self._circuit_allows(endpoint, now):
+                self._stats["rejected"] += 1
+                return False
+            if endpoint.state == HALF_OPEN:
+                endpoint.probing = True
+                endpoint.opened_at = now
+            return True
+
+    def record(self, name, status, seconds):
+        """
+        Records the outcome of an upstream call: its HTTP status (or "timeout" /
+        "error") and how long it took.
+        """
+        now = time.monotonic()
+        failed = is_failure(status)
+        with self._lock:
+            endpoint = self._endpoint(name)
+            if endpoint.state == HALF_OPEN:
+                endpoint.probing = False
+                if failed:
+                    self._open(endpoint, now)
+                    return
+                # Back to normal; forget the failures that opened the circuit.
+                endpoint.state = CLOSED
+                endpoint.samples.clear()
+            endpoint.samples.append((now, seconds, failed))
+            endpoint.p95 = None
+            if endpoint.state != CLOSED or not failed:
+                return
+            self._trim(endpoint, now)
+            samples = endpoint.samples
+            if len(samples) >= self.min_samples and sum(s[2] for s in samples) >= self.error_rate * len(samples):
+                self._open(endpoint, now)
+
+    def _open(self, endpoint, now):
+        endpoint.state = OPEN
+        endpoint.opened_at = now
+        self._stats["circuit_opened"] += 1
+
+    # --- latency budgets ---
+
+    def _p95(self, endpoint, now):
+        # Recomputed at most once a second per endpoint, or after a new sample.
+        if endpoint.p95 is None or now - endpoint.p95_at >= 1:
+            self._trim(endpoint, now)
+            if len(endpoint.samples) < self.min_samples:
+                endpoint.p95 = 0.0
+            else:
+                latencies = sorted(s[1] for s in endpoint.samples)
+                endpoint.p95 = latencies[int(0.95 * (len(latencies) - 1))]
+            endpoint.p95_at = now
+        return endpoint.p95
+
+    def _health(self, name, now):
+        # Returns (usable, load, reason): load is p95 latency as a share of the budget,
+        # reason says why the endpoint should be avoided (None when healthy).
+        endpoint = self._endpoint(name)
+        if endpoint.state != CLOSED and not self._circuit_allows(endpoint, now):
+            return False, None, "circuit open"
+        budget = self.budgets.get(name)
+        if not budget:
+            return True, 0.0, None
+        p95 = self._p95(endpoint, now)
+        if p95 > budget:
+            return True, p95 / budget, f"p95 {p95:.1f}s over {budget:g}s budget"
+        return True, p95 / budget, None
+
+    def choose(self, mode, allowed=None, is_cached=None):
+        """
+        Returns (mode to serve, reason) for a request for mode. The reason is
+        None when mode itself is healthy; otherwise it says why mode was
+        passed over for the first healthy fallback. With no healthy choice,
+        the least loaded usable one is served; if every circuit is open, mode
+        is returned and its call fails fast. allowed, if given, limits the
+        fallbacks considered to those modes. is_cached, if given, is called
+        only when mode would be degraded; if it returns True, mode is served.
+        """
+        now = time.monotonic()
+        with self._lock:
+            usable, load, reason = self._health(mode, now)
+            if reason is None:
+                return mode, None
+            best, best_load = (mode, load) if usable else (None, None)
+            for fallback in self.fallbacks.get(mode, ()):
+                if allowed is not None and fallback not in allowed:
+                    continue
+                fallback_usable, fallback_load, fallback_reason = self._health(fallback, now)
+                if fallback_reason is None:
+                    best = fallback
+                    break
+                if fallback_usable and (best is None or fallback_load < best_load):
+                    best, best_load = fallback, fallback_load
+            if best is None or best == mode:
+                return mode, None
+        # Outside the lock: the check may hit the disk.
+        if is_cached is not None and is_cached():
+            return mode, None
+        key = f"{mode}->{best}"
+        with self._lock:
+            self._stats["degraded"][key] = self._stats["degraded"].get(key, 0) + 1
+        return best, f"{mode}: {reason}"
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = {
+                "degraded": dict(self._stats["degraded"]),
+                "circuit_opened": self._stats["circuit_opened"],
+                "rejected": self._stats["rejected"],
+                "endpoints": {},
+            }
+            for name, endpoint in self._endpoints.items():
+                self._trim(endpoint, now)
+                samples = endpoint.samples
+                stats["endpoints"][name] = {
+                    "state": endpoint.state,
+                    "calls": len(samples),
+                    "error_rate": sum(s[2] for s in samples) / len(samples) if samples else 0.0,
+                    "p95": self._p95(endpoint, now),
+                }
+        return stats
+
+
+def choose_mode(mode, is_cached=None, allowed=None):
+    """
+    Returns (mode to serve, degraded) for an /ask request for mode, where
+    degraded is None or the "degraded" object added to the response.
+    is_cached, if given, is called when mode would be degraded to tell
+    whether its answer is already cached; a cached answer is always served
+    as requested. allowed limits the fallbacks as in DegradationPolicy.choose.
+    """
+    if degradation is None:
+        return mode, None
+    served, reason = degradation.choose(mode, allowed, is_cached)
+    if reason is None:
+        return mode, None
+    metrics.mark("degraded", served)
+    return served, {"requested_mode": mode, "mode": served, "reason": reason}
+
+
+degradation = (
+    DegradationPolicy(
+        DEGRADE_WINDOW, DEGRADE_MIN_SAMPLES, DEGRADE_LATENCY_BUDGETS, DEGRADE_FALLBACKS,
+        CIRCUIT_ERROR_RATE, CIRCUIT_OPEN_SECONDS,
+    )
+    if DEGRADE_WINDOW > 0 else None
+)
@@ -0,0 +1,167 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from config import (
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+)
+
+# Upstream statuses worth retrying. 501 is deliberately absent: Wolfram uses it
+# for "input not understood", which will never succeed on a second attempt.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_stats_lock = threading.Lock()
+_stats = {"checkouts": 0, "new_connections": 0}
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        _count("checkouts")
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        _count("new_connections")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        _count("checkouts")
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        _count("new_connections")
+        return super()._new_conn()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools record how often a connection is
+    checked out and how often a brand new one has to be opened.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+def _build_retry(methods):
+    # Only connection failures and 5xx statuses are retried. A read timeout means
+    # the upstream took the call (and billed it) and may hang just as long again;
+    # read=False re-raises it as is instead of wrapping it in MaxRetryError.
+    return Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=False,
+        other=0,
+        status=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=methods,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+
+
+def max_request_seconds():
+    """
+    Upper bound on how long one upstream request can take with its retries and
+    backoff, for anything that waits on another request's upstream call. Not
+    included: Retry-After waits and reading a streamed body past its first bytes.
+    """
+    attempts = HTTP_MAX_RETRIES + 1
+    backoff = sum(HTTP_BACKOFF_FACTOR * 2 ** attempt for attempt in range(HTTP_MAX_RETRIES))
+    return attempts * (HTTP_CONNECT_TIMEOUT + HTTP_READ_TIMEOUT) + backoff
+
+
+# The adapter (and therefore its connection pools) is shared process-wide;
+# each thread gets its own lightweight Session on top of it, since Session
+# objects themselves are not safe to share across threads.
+_adapter_lock = threading.Lock()
+_adapter = None
+_local = threading.local()
+
+
+def _get_adapter():
+    global _adapter
+    if _adapter is None:
+        with _adapter_lock:
+            if _adapter is None:
+                _adapter = PooledHTTPAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    max_retries=_build_retry(frozenset(["GET", "HEAD"])),
+                )
+    return _adapter
+
+
+def get_session():
+    """
+    Returns the calling thread's Session, backed by the shared connection pools.
+    """
+    session = getattr(_local, "session", None)
+    if session is None:
+        adapter = _get_adapter()
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+
+def default_timeout():
+    """
+    Returns the (connect, read) timeout tuple applied to every upstream call.
+    """
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def get(url, **kwargs):
+    """
+    Issues a GET through the shared pool, applying the default timeouts unless
+    the caller provides its own.
+    """
+    kwargs.setdefault("timeout", default_timeout())
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    """
+    Issues a POST through the shared pool. Only connection failures are retried;
+    a POST that reached the server is never replayed.
+    """
+    kwargs.setdefault("timeout", default_timeout())
+    return get_session().post(url, **kwargs)
+
+
+def get_pool_stats():
+    """
+    Returns connection pool counters: total checkouts, new connections opened
+    and connections reused from the pool.
+    """
+    with _stats_lock:
+        checkouts = _stats["checkouts"]
+        new_connections = _stats["new_connections"]
+    return {
+        "checkouts": checkouts,
+        "new_connections": new_connections,
+        "reused_connections": max(checkouts - new_connections, 0),
+        "pool_connections": HTTP_POOL_CONNECTIONS,
+        "pool_maxsize": HTTP_POOL_MAXSIZE,
+    }
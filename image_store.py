@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from cache import make_key, response_cache
+from config import IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES, IMAGE_STORE_REENCODE
+from http_client import max_request_seconds
+
+logger = logging.getLogger(__name__)
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def image_key(question, width=None):
+    """
+    Cache key under which the digest of a stored Simple API image is recorded.
+    """
+    return make_key("simple_image", {"question": question, "width": width})
+
+
+def _reencode(path):
+    """
+    Losslessly re-compresses a PNG in place when Pillow is available.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    try:
+        with Image.open(path) as image:
+            image.load()
+            optimized = path + ".opt"
+            image.save(optimized, format="PNG", optimize=True)
+        if os.path.getsize(optimized) < os.path.getsize(path):
+            os.replace(optimized, path)
+        else:
+            os.remove(optimized)
+    except OSError as e:
+        logger.warning("Could not re-encode image %s: %s", path, e)
+
+
+class _Claim:
+    __slots__ = ("done", "claimed_at", "error")
+
+    def __init__(self, done, claimed_at):
+        self.done = done
+        self.claimed_at = claimed_at
+        self.error = None
+
+
+class ImageStore:
+    """
+    Content-addressed on-disk store for Simple API images. Files are named by
+    the SHA-256 of their bytes, so identical images are stored once and the
+    digest doubles as a strong ETag. The question -> digest index is kept
+    next to the images, one small file per cache key under index/, so it
+    survives restarts and is shared by every worker using the directory.
+    Index entries expire after the Simple API TTL of the response cache.
+
+    Concurrent requests for the same image are coalesced: the first one
+    claims the key and streams the image from upstream, the others wait for
+    its download to be committed and are served from the stored file. A
+    claim expires after claim_seconds, so a download that was abandoned
+    without releasing it (e.g. a response that was never iterated) does not
+    hold up later requests.
+    """
+
+    def __init__(self, directory, max_bytes, reencode=False, claim_seconds=60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.reencode = reencode
+        self.claim_seconds = claim_seconds
+        self._lock = threading.Lock()
+        self._downloads = {}  # key -> _Claim
+        self._async_downloads = {}
+        self._collapsed = 0
+        self._index_dir = os.path.join(directory, "index")
+        os.makedirs(self._index_dir, exist_ok=True)
+        self._bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".png"))
+
+    def path_for(self, digest):
+        """
+        Returns the file path for a digest if that image is stored, else None.
+        """
+        if not _DIGEST_RE.match(digest or ""):
+            return None
+        path = os.path.join(self.directory, digest + ".png")
+        return path if os.path.exists(path) else None
+
+    def lookup(self, key):
+        """
+        Returns (digest, path) of the image stored for a cache key, or (None, None).
+        """
+        ttl = response_cache.ttl_for("simple")
+        if not ttl or not _DIGEST_RE.match(key):
+            return None, None
+        index_path = os.path.join(self._index_dir, key)
+        try:
+            if os.path.getmtime(index_path) + ttl <= time.time():
+                return None, None
+            with open(index_path, encoding="ascii") as f:
+                digest = f.read()
+        except OSError:
+            return None, None
+        path = self.path_for(digest)
+        if path is None:
+            return None, None
+        return digest, path
+
+    def contains(self, key):
+        """
+        Whether an unexpired image is stored for a cache key.
+        """
+        return self.lookup(key)[1] is not None
+
+    def claim(self, key):
+        """
+        Returns (claim, leader). If leader is True the caller downloads the
+        image for key and must release() the claim when done; tee() does so
+        when given it. Otherwise another download for key is in progress: the
+        caller waits on claim.done, at most claim_seconds, then re-raises
+        claim.error if the download failed or else tries lookup(key) again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            claim = self._downloads.get(key)
+            if claim is not None and now - claim.claimed_at < self.claim_seconds:
+                self._collapsed += 1
+                return claim, False
+            claim = self._downloads[key] = _Claim(threading.Event(), now)
+            return claim, True
+
+    def release(self, key, claim, error=None):
+        """
+        Ends a claim made by claim() and wakes up its waiters, which are given
+        error if the download failed before any of the image was received.
+        Cancellation and other BaseExceptions are not passed on.
+        """
+        with self._lock:
+            if self._downloads.get(key) is claim:
+                del self._downloads[key]
+        claim.error = error if isinstance(error, Exception) else None
+        claim.done.set()
+
+    def aclaim(self, key):
+        """
+        Async counterpart of claim() for the ASGI app; claim.done is an
+        asyncio.Event. Must be used from a single event loop.
+        """
+        now = time.monotonic()
+        claim = self._async_downloads.get(key)
+        if claim is not None and now - claim.claimed_at < self.claim_seconds:
+            self._collapsed += 1
+            return claim, False
+        claim = self._async_downloads[key] = _Claim(asyncio.Event(), now)
+        return claim, True
+
+    def arelease(self, key, claim, error=None):
+        """
+        Async counterpart of release().
+        """
+        if self._async_downloads.get(key) is claim:
+            del self._async_downloads[key]
+        claim.error = error if isinstance(error, Exception) else None
+        claim.done.set()
+
+    def tee(self, key, chunks, claim=None):
+        """
+        Passes chunks through unchanged while writing them to the store. The
+        image is committed and recorded under key only if the iteration
+        completes; a failed or abandoned download leaves nothing behind.
+        The claim from claim(key), if given, is released at the end.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        committed = False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            self._commit(key, tmp_path)
+            committed = True
+        finally:
+            if not committed and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if claim is not None:
+                self.release(key, claim)
+
+    async def atee(self, key, chunks, claim=None):
+        """
+        Async counterpart of tee() for the ASGI app.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        committed = False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            self._commit(key, tmp_path)
+            committed = True
+        finally:
+            if not committed and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if claim is not None:
+                self.arelease(key, claim)
+
+    def _commit(self, key, tmp_path):
+        if self.reencode:
+            _reencode(tmp_path)
+        digest = hashlib.sha256()
+        with open(tmp_path, "rb") as f:
+            for block in iter(lambda: f.read(65536), b""):
+                digest.update(block)
+        digest = digest.hexdigest()
+        path = os.path.join(self.directory, digest + ".png")
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                os.utime(path)
+            else:
+                os.replace(tmp_path, path)
+                self._bytes += size
+                if self._bytes > self.max_bytes:
+                    self._prune()
+        self._index(key, digest)
+        return digest
+
+    def _index(self, key, digest):
+        # Written to a temporary file and renamed, so readers never see a partial digest.
+        if not response_cache.ttl_for("simple"):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self._index_dir, suffix=".part")
+        with os.fdopen(fd, "w", encoding="ascii") as f:
+            f.write(digest)
+        os.replace(tmp_path, os.path.join(self._index_dir, key))
+
+    def _prune(self):
+        # Drop least recently written images until back under 90% of the limit.
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".png")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in entries:
+            if self._bytes <= self.max_bytes * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._bytes -= size
+        # Expired index entries go too; entries for pruned images are just misses.
+        expired_before = time.time() - response_cache.ttl_for("simple")
+        for entry in os.scandir(self._index_dir):
+            try:
+                if entry.stat().st_mtime <= expired_before:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "directory": self.directory,
+                "collapsed": self._collapsed,
+                "in_flight": len(self._downloads) + len(self._async_downloads),
+            }
+
+
+def _create_store():
+    if not IMAGE_STORE_DIR:
+        return None
+    try:
+        return ImageStore(
+            IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES, IMAGE_STORE_REENCODE,
+            claim_seconds=max_request_seconds(),
+        )
+    except OSError as e:
+        # e.g. a read-only filesystem; images are then streamed without being stored.
+        logger.warning("Image store disabled, cannot use %s: %s", IMAGE_STORE_DIR, e)
+        return None
+
+
+image_store = _create_store()
@@ -0,0 +1,171 @@
+import codecs
+import json
+import re
+
+_WHITESPACE = " \t\r\n"
+# Characters that matter to the element scanner outside and inside strings
+_STRUCTURE_RE = re.compile(r'["{}\[\],]')
+_STRING_RE = re.compile(r'["\\]')
+
+
+class StreamingArrayParser:
+    """
+    Incrementally parses a JSON document arriving in chunks and yields the
+    elements of one array, found by its key, as soon as each element is
+    complete. Everything outside that array is kept, and once the input is
+    exhausted finish() returns the document with the array emptied.
+
+    The key is matched at any nesting depth outside of strings; the first
+    occurrence wins. Elements are scanned incrementally (nesting depth and
+    string/escape state carry over between chunks) and each one is decoded
+    once, when it ends, so parsing time is linear in the input size.
+    """
+
+    def __init__(self, key):
+        self._key = key
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._state = "head"  # head -> items -> tail
+        self._head = []
+        self._tail = []
+        # Element scanner state
+        self._parts = []  # text of the element in progress from earlier chunks
+        self._started = False
+        self._depth = 0
+        self._item_in_string = False
+        self._item_escape = False
+        # Head scanner state
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._expect = None  # None, "colon" or "bracket"
+
+    def feed(self, chunk):
+        """
+        Consumes the next chunk (bytes or str) and returns the list of array
+        elements completed by it.
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        items = []
+        if self._state == "head":
+            chunk = self._scan_head(chunk)
+        if self._state == "items":
+            items = self._parse_items(chunk)
+            chunk = ""
+        if self._state == "tail":
+            self._tail.append(chunk)
+        return items
+
+    def finish(self):
+        """
+        Parses what remains outside the array and returns it with the array
+        replaced by []. Raises ValueError if the document is incomplete or
+        the key was never found.
+        """
+        tail = self._decoder.decode(b"", final=True)
+        if self._state != "tail":
+            raise ValueError(f"JSON array {self._key!r} not found or not terminated")
+        return json.loads("".join(self._head) + "[]" + "".join(self._tail) + tail)
+
+    def _scan_head(self, chunk):
+        """
+        Scans for `"key": [` outside of strings. Returns the part of the chunk
+        following the opening bracket, or "" if it has not been seen yet.
+        """
+        base = sum(len(part) for part in self._head)
+        for i, char in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    text = "".join(self._head) + chunk[:i]
+                    self._last_string = text[self._string_start:]
+                    self._expect = "colon"
+                continue
+            if char in _WHITESPACE:
+                continue
+            if self._expect == "colon" and char == ":":
+                self._expect = "bracket" if self._last_string == self._key else None
+                continue
+            if self._expect == "bracket" and char == "[":
+                self._head.append(chunk[:i])
+                self._state = "items"
+                return chunk[i + 1:]
+            self._expect = None
+            if char == '"':
+                self._in_string = True
+                self._string_start = base + i + 1
+        self._head.append(chunk)
+        return ""
+
+    def _parse_items(self, chunk):
+        """
+        Scans chunk for the end of the element in progress and of any further
+        elements, returning those completed. Whatever follows the closing
+        bracket of the array goes to the tail.
+        """
+        items = []
+        start = 0 if self._started else None  # where the element in progress starts in chunk
+        pos, end = 0, len(chunk)
+        while pos < end:
+            if self._item_in_string:
+                if self._item_escape:
+                    self._item_escape = False
+                    pos += 1
+                    continue
+                match = _STRING_RE.search(chunk, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if match.group() == "\\":
+                    self._item_escape = True
+                    continue
+                self._item_in_string = False
+                if self._depth == 0:
+                    items.append(self._complete(chunk, start, pos))
+                    start = None
+                continue
+            if start is None:
+                char = chunk[pos]
+                if char in _WHITESPACE or char == ",":
+                    pos += 1
+                    continue
+                if char == "]":
+                    self._state = "tail"
+                    self._tail.append(chunk[pos + 1:])
+                    self._started = False
+                    return items
+                start = pos
+            match = _STRUCTURE_RE.search(chunk, pos)
+            if match is None:
+                break
+            char, pos = match.group(), match.end()
+            if char == '"':
+                self._item_in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif self._depth > 0:
+                if char in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        items.append(self._complete(chunk, start, pos))
+                        start = None
+            else:
+                # A top-level "," or "]" ends a number, true, false or null element.
+                pos = match.start()
+                items.append(self._complete(chunk, start, pos))
+                start = None
+        if start is not None:
+            self._parts.append(chunk[start:])
+        self._started = start is not None
+        return items
+
+    def _complete(self, chunk, start, end):
+        self._parts.append(chunk[start:end])
+        text = "".join(self._parts)
+        self._parts = []
+        return json.loads(text)
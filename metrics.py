@@ -0,0 +1,410 @@
+"""
+Per-request instrumentation shared by app.py and asgi.py.
+
+- phase() times a section of work (upstream call, parsing, serialization, ...)
+  into the current request; the totals are sent back in a Server-Timing header.
+- upstream() times one upstream HTTP call into a histogram by mode and status.
+- render() returns every metric in the Prometheus text format for /metrics.
+- With PROFILE_SLOW_REQUEST_MS set, a sampling profiler records the stacks of
+  each request and dumps those of slow requests to PROFILE_DIR.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from config import PROFILE_SLOW_REQUEST_MS, PROFILE_SAMPLE_INTERVAL_MS, PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram with a fixed set of label names.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+        labelnames = self.labelnames + ("le",)
+        for labelvalues, counts in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(labelnames, labelvalues + (repr(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(labelnames, labelvalues + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {counts[-1]}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {counts[-2]}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce a response (up to the first byte for streamed bodies).",
+    ("route", "method", "status"),
+)
+request_phase_duration = Histogram(
+    "http_request_phase_duration_seconds",
+    "Time spent per request in each instrumented phase.",
+    ("route", "phase"),
+)
+upstream_duration = Histogram(
+    "upstream_request_duration_seconds",
+    "Upstream call latency by answer mode (or Quezzio endpoint) and HTTP status.",
+    ("mode", "status"),
+)
+scheduler_wait = Histogram(
+    "upstream_queue_wait_seconds",
+    "Time upstream calls waited in the scheduler queue for a rate-limit token, by priority.",
+    ("priority",),
+)
+
+_HISTOGRAMS = (request_duration, request_phase_duration, upstream_duration, scheduler_wait)
+
+
+class RequestTiming:
+    """
+    Phase totals and markers for one request, reported as a Server-Timing header.
+    """
+
+    __slots__ = ("started", "phases", "marks", "profile", "_lock")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.marks = {}
+        self.profile = None
+        # Batch requests add phases from several worker threads.
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self, total):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        parts.extend(f'{name};desc="{desc}"' for name, desc in self.marks.items())
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current = contextvars.ContextVar("request_timing", default=None)
+
+
+@contextmanager
+def phase(name):
+    """
+    Adds the time spent in the with block to the current request's phase total.
+    Outside of a request this only costs two clock reads.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing = _current.get()
+        if timing is not None:
+            timing.add(name, time.perf_counter() - started)
+
+
+def mark(name, desc):
+    """
+    Attaches a descriptive marker (e.g. cache hit/miss) to the current request.
+    """
+    timing = _current.get()
+    if timing is not None:
+        timing.marks[name] = desc
+
+
+class _UpstreamCall:
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = "error"
+
+
+@contextmanager
+def upstream(mode):
+    """
+    Times one upstream call. Set .status on the yielded object to the HTTP
+    status code; calls that raise are recorded with the status left as "error"
+    unless the caller set something more specific (e.g. "timeout").
+    """
+    call = _UpstreamCall()
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        record_upstream(mode, call.status, time.perf_counter() - started)
+
+
+def record_upstream(mode, status, seconds):
+    """
+    Records an upstream call timed by the caller, e.g. up to the response
+    headers of a streamed body.
+    """
+    upstream_duration.observe(seconds, mode, str(status))
+    timing = _current.get()
+    if timing is not None:
+        timing.add("upstream", seconds)
+
+
+_startup = {}
+
+
+def record_startup(phase, seconds):
+    """
+    Records how long a step of worker startup took (e.g. imports, create_app).
+    """
+    _startup[phase] = seconds
+
+
+def start_request():
+    """
+    Begins timing the current request; call from a before-request hook.
+    """
+    timing = RequestTiming()
+    _current.set(timing)
+    if profiler is not None:
+        timing.profile = profiler.start()
+    return timing
+
+
+def finish_request(route, method, status, headers):
+    """
+    Records the current request's metrics and adds its Server-Timing header;
+    call from an after-request hook.
+    """
+    timing = _current.get()
+    if timing is None:
+        return
+    _current.set(None)
+    total = time.perf_counter() - timing.started
+    request_duration.observe(total, route, method, str(status))
+    for name, seconds in timing.phases.items():
+        request_phase_duration.observe(seconds, route, name)
+    headers["Server-Timing"] = timing.server_timing(total)
+    if timing.profile is not None:
+        profiler.stop(timing.profile, total, f"{method} {route}")
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of every thread serving a request each interval
+    seconds. When a request takes at least threshold seconds, its samples are
+    written to directory as collapsed stacks ("folded" format, readable by
+    flamegraph.pl and speedscope). On the ASGI app all requests share the
+    event loop thread, so concurrent requests see each other's samples.
+    """
+
+    def __init__(self, threshold, interval, directory):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._active = {}  # id(samples) -> (thread id, samples)
+        self._thread = None
+        self._dumps = 0
+
+    def start(self):
+        samples = Counter()
+        with self._lock:
+            self._active[id(samples)] = (threading.get_ident(), samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        return samples
+
+    def stop(self, samples, elapsed, label):
+        with self._lock:
+            self._active.pop(id(samples), None)
+        if elapsed >= self.threshold and samples:
+            self._dump(samples, elapsed, label)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[_collapse(frame)] += 1
+
+    def _dump(self, samples, elapsed, label):
+        with self._lock:
+            self._dumps += 1
+            sequence = self._dumps
+        name = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_")
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{sequence}-{name}-{elapsed * 1000:.0f}ms.folded"
+        path = os.path.join(self.directory, filename)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            logger.warning("Could not write request profile %s: %s", path, e)
+            return
+        logger.info("Slow request %s took %.0f ms; profile written to %s", label, elapsed * 1000, path)
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+profiler = (
+    SamplingProfiler(PROFILE_SLOW_REQUEST_MS / 1000.0, PROFILE_SAMPLE_INTERVAL_MS / 1000.0, PROFILE_DIR)
+    if PROFILE_SLOW_REQUEST_MS > 0 else None
+)
+
+
+def _stat_lines(name, kind, documentation, samples):
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{labels} {value}")
+    return lines
+
+
+def _runtime_lines():
+    # Imported here: those modules import this one (through models) at load time.
+    import http_client
+    from cache import response_cache
+    from singleflight import wolfram_flight, wolfram_async_flight
+
+    lines = []
+    if _startup:
+        samples = [(_format_labels(("phase",), (phase,)), seconds) for phase, seconds in _startup.items()]
+        lines += _stat_lines("process_startup_seconds", "gauge", "Time spent in each step of worker startup.", samples)
+
+    pool = http_client.get_pool_stats()
+    lines += _stat_lines("http_pool_checkouts_total", "counter", "Connections checked out of the shared pool.", [("", pool["checkouts"])])
+    lines += _stat_lines("http_pool_new_connections_total", "counter", "New upstream connections opened.", [("", pool["new_connections"])])
+
+    cache = response_cache.stats()
+    for stat in ("hits", "memory_hits", "disk_hits", "misses", "stores", "evictions", "disk_evictions", "expirations"):
+        lines += _stat_lines(f"response_cache_{stat}_total", "counter", f"Response cache {stat.replace('_', ' ')}.", [("", cache[stat])])
+    lines += _stat_lines("response_cache_entries", "gauge", "Entries in the in-memory response cache.", [("", cache["entries"])])
+    lines += _stat_lines("response_cache_bytes", "gauge", "Payload bytes held by the in-memory response cache.", [("", cache["bytes"])])
+
+    flights = (("sync", wolfram_flight.stats()), ("async", wolfram_async_flight.stats()))
+    for stat, kind in (("calls", "counter"), ("executions", "counter"), ("collapsed", "counter"), ("in_flight", "gauge")):
+        name = f"singleflight_{stat}" + ("_total" if kind == "counter" else "")
+        samples = [(_format_labels(("flight",), (flight,)), stats[stat]) for flight, stats in flights]
+        lines += _stat_lines(name, kind, f"Single-flight {stat.replace('_', ' ')} for upstream calls.", samples)
+
+    # Stores that only some routes use are reported once a request has loaded them.
+    image_store = getattr(sys.modules.get("image_store"), "image_store", None)
+    if image_store is not None:
+        store = image_store.stats()
+        lines += _stat_lines("image_store_bytes", "gauge", "Bytes of stored Simple API images.", [("", store["bytes"])])
+        lines += _stat_lines("image_store_collapsed_total", "counter", "Simple API requests served from another request's download.", [("", store["collapsed"])])
+
+    from scheduler import scheduler
+    if scheduler is not None:
+        sched = scheduler.stats()
+        for stat in ("admitted", "queued", "rejected", "timeouts"):
+            lines += _stat_lines(f"upstream_scheduler_{stat}_total", "counter", f"Upstream calls {stat} by the scheduler.", [("", sched[stat])])
+        samples = [(_format_labels(("priority",), (priority,)), depth) for priority, depth in sched["queue_depth"].items()]
+        lines += _stat_lines("upstream_scheduler_queue_depth", "gauge", "Upstream calls waiting for a rate-limit token, by priority.", samples)
+
+    from degradation import degradation
+    if degradation is not None:
+        policy = degradation.stats()
+        samples = [
+            (_format_labels(("requested_mode", "served_mode"), key.split("->")), count)
+            for key, count in policy["degraded"].items()
+        ]
+        lines += _stat_lines("degraded_requests_total", "counter", "/ask requests served with a cheaper mode.", samples)
+        lines += _stat_lines("circuit_opened_total", "counter", "Times an endpoint circuit breaker opened.", [("", policy["circuit_opened"])])
+        lines += _stat_lines("circuit_rejected_total", "counter", "Upstream calls refused by an open circuit.", [("", policy["rejected"])])
+        states = {"closed": 0, "half_open": 1, "open": 2}
+        endpoints = policy["endpoints"].items()
+        lines += _stat_lines(
+            "circuit_state", "gauge", "Circuit breaker state per endpoint (0 closed, 1 half-open, 2 open).",
+            [(_format_labels(("endpoint",), (name,)), states[health["state"]]) for name, health in endpoints],
+        )
+        lines += _stat_lines(
+            "upstream_window_p95_seconds", "gauge", "Rolling p95 upstream latency per endpoint, as used for degradation.",
+            [(_format_labels(("endpoint",), (name,)), health["p95"]) for name, health in endpoints],
+        )
+        lines += _stat_lines(
+            "upstream_window_error_ratio", "gauge", "Rolling share of failed upstream calls per endpoint.",
+            [(_format_labels(("endpoint",), (name,)), round(health["error_rate"], 4)) for name, health in endpoints],
+        )
+
+    from query_index import query_index
+    if query_index is not None:
+        index = query_index.stats()
+        lines += _stat_lines("query_index_lookups_total", "counter", "Questions resolved through the similarity index.", [("", index["lookups"])])
+        lines += _stat_lines("query_index_merges_total", "counter", "Questions merged onto an earlier similar question.", [("", index["merges"])])
+        lines += _stat_lines("query_index_entries", "gauge", "Canonical questions remembered by the similarity index.", [("", index["entries"])])
+
+    wpg_store = getattr(sys.modules.get("wpg_store"), "wpg_store", None)
+    if wpg_store is not None:
+        store = wpg_store.stats()
+        for stat in ("topic_hits", "topic_misses", "question_hits", "question_misses", "refreshes", "refresh_errors"):
+            lines += _stat_lines(f"wpg_store_{stat}_total", "counter", f"WPG store {stat.replace('_', ' ')}.", [("", store[stat])])
+        lines += _stat_lines("wpg_store_questions", "gauge", "Generated questions held in the WPG store.", [("", store["questions"])])
+    return lines
+
+
+def render():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for histogram in _HISTOGRAMS:
+        lines += histogram.collect()
+    lines += _runtime_lines()
+    return "\n".join(lines) + "\n"
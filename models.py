@@ -0,0 +1,166 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library is used without it
+    orjson = None
+
+import metrics
+
+
+# Subpod output fields that callers can project on
+SUBPOD_FIELDS = ("plaintext", "img", "imagemap", "mathml", "sound", "wav", "minput", "moutput", "cell")
+
+
+class Subpod:
+    """
+    One subpod of a Full Results pod. Fields the API did not return (or
+    returned empty) are None and are left out when serialized.
+    """
+
+    __slots__ = ("title",) + SUBPOD_FIELDS + ("states",)
+
+    @classmethod
+    def from_api(cls, sub):
+        self = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(self, name, sub.get(name) or None)
+        return self
+
+    def to_dict(self, fields=None):
+        """
+        Returns the subpod as a dict with absent fields omitted. fields limits
+        the output fields (see SUBPOD_FIELDS) included; title and states are always kept.
+        """
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if fields is not None and name in SUBPOD_FIELDS and name not in fields:
+                continue
+            data[name] = value
+        return data
+
+
+class Pod:
+    """
+    One Full Results pod. subpods is always present; other absent fields are omitted.
+    """
+
+    __slots__ = ("title", "id", "primary", "scanner", "position", "subpods", "states", "infos")
+
+    @classmethod
+    def from_api(cls, pod):
+        self = cls.__new__(cls)
+        self.title = pod.get("title")
+        self.id = pod.get("id")
+        self.primary = pod.get("primary") or None
+        self.scanner = pod.get("scanner")
+        self.position = pod.get("position")
+        self.subpods = [Subpod.from_api(sub) for sub in pod.get("subpods", ())]
+        self.states = pod.get("states") or None
+        self.infos = pod.get("infos") or None
+        return self
+
+    def to_dict(self, fields=None):
+        data = {}
+        for name in self.__slots__:
+            if name == "subpods":
+                data[name] = [sub.to_dict(fields) for sub in self.subpods]
+                continue
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        return data
+
+
+class QueryResult:
+    """
+    Parsed Full Results API query result.
+    """
+
+    __slots__ = (
+        "success", "error", "numpods", "datatypes", "pods",
+        "assumptions", "warnings", "sources", "generalizations",
+    )
+    _EXTRA = ("assumptions", "warnings", "sources", "generalizations")
+
+    @classmethod
+    def from_api(cls, queryresult):
+        """
+        Builds a result from the API's "queryresult" object, or from the output
+        of to_dict(), which has the same shape.
+        """
+        self = cls.__new__(cls)
+        self.success = queryresult.get("success", False)
+        self.error = queryresult.get("error", False)
+        self.numpods = queryresult.get("numpods", 0)
+        self.datatypes = queryresult.get("datatypes", "")
+        self.pods = [Pod.from_api(pod) for pod in queryresult.get("pods", ())]
+        for name in self._EXTRA:
+            setattr(self, name, queryresult.get(name))
+        return self
+
+    def to_dict(self, fields=None, include_pods=True):
+        data = {
+            "success": self.success,
+            "error": self.error,
+            "numpods": self.numpods,
+            "datatypes": self.datatypes,
+        }
+        if include_pods:
+            data["pods"] = [pod.to_dict(fields) for pod in self.pods]
+        for name in self._EXTRA:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        return data
+
+
+_MODELS = (QueryResult, Pod, Subpod)
+
+
+def json_default(obj):
+    """
+    JSON fallback for the result models; pass as default= to a JSON encoder.
+    """
+    if isinstance(obj, _MODELS):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj, default=json_default, sort_keys=False, indent=None):
+    """
+    Serializes obj to a JSON string, using orjson when it is installed.
+    default is called for objects the encoder cannot serialize natively.
+    """
+    if orjson is not None:
+        option = 0
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option).decode("utf-8")
+    separators = None if indent else (",", ":")
+    return json.dumps(obj, default=default, sort_keys=sort_keys, indent=indent, separators=separators, ensure_ascii=False)
+
+
+class ResultJSONMixin:
+    """
+    Mixin for Flask/Quart JSON providers: serializes the result models via
+    dumps() above, and does not sort keys.
+    """
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        fallback = kwargs.get("default", self.default)
+
+        def default(o):
+            if isinstance(o, _MODELS):
+                return o.to_dict()
+            return fallback(o)
+
+        with metrics.phase("serialize"):
+            return dumps(obj, default=default, sort_keys=kwargs.get("sort_keys", self.sort_keys), indent=kwargs.get("indent"))
@@ -0,0 +1,221 @@
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from difflib import SequenceMatcher
+
+from config import QUERY_SIMILARITY_THRESHOLD, QUERY_INDEX_MAX_ENTRIES, QUERY_MERGE_LOG
+
+logger = logging.getLogger(__name__)
+
+# Unicode math symbols and their plain-text spelling. Applied before NFKC, which
+# would otherwise turn "x²" into "x2".
+_SYMBOLS = {
+    "×": "*", "⋅": "*", "·": "*", "∙": "*", "✕": "*",
+    "÷": "/", "∕": "/",
+    "−": "-", "–": "-", "—": "-",
+    "≤": "<=", "≥": ">=", "≠": "!=",
+    "π": "pi", "∞": "infinity",
+    "∫": "integrate ", "∑": "sum ",
+}
+_SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹⁻⁺", "0123456789-+")
+_SUBSCRIPTS = str.maketrans("₀₁₂₃₄₅₆₇₈₉", "0123456789")
+
+_SYMBOL_RE = re.compile("|".join(map(re.escape, _SYMBOLS)))
+_SUPERSCRIPT_RE = re.compile("[⁰¹²³⁴⁵⁶⁷⁸⁹⁻⁺]+")
+_SUBSCRIPT_RE = re.compile("[₀₁₂₃₄₅₆₇₈₉]+")
+_ROOT_RE = re.compile(r"([√∛])\s*(\(|[\w.]+)")
+_OPERATORS = set("=+-*/^<>!(),")
+
+# Commands that may trail the expression ("x^2=4 solve") and are moved to the front
+_COMMANDS = {
+    "solve", "simplify", "factor", "expand", "integrate", "differentiate",
+    "derivative", "integral", "plot", "graph", "evaluate", "compute", "calculate",
+}
+# Words that do not change what is being asked; ignored when comparing questions.
+# No single letters: "a" in "integrate a dx" is a variable.
+_STOPWORDS = {"what", "is", "the", "of", "an", "please", "for", "me", "whats", "find"}
+# Words that flip the meaning of a question; compared exactly like expressions
+_NEGATIONS = {"not", "no", "never", "without", "except", "non"}
+# Numbers spelled out; compared exactly like expressions ("two thousand" is not "two thousand ten")
+_NUMBER_WORDS = {
+    "zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+    "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen",
+    "nineteen", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety",
+    "hundred", "thousand", "million", "billion", "trillion", "dozen", "half", "quarter",
+    "first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth", "ninth", "tenth",
+    "once", "twice", "double", "triple",
+}
+
+
+def _root(match):
+    name = "sqrt" if match.group(1) == "√" else "cbrt"
+    operand = match.group(2)
+    return name + "(" if operand == "(" else f"{name}({operand})"
+
+
+def _is_math(token):
+    return not (token.isalpha() and len(token) > 1)
+
+
+def _fold(token, first):
+    # Case matters in chemical formulas and unit prefixes ("CO" vs "Co", "Mm" vs "mm"),
+    # so only the sentence capital of a first word is folded ("What", "Solve").
+    if first and len(token) > 2 and token.isalpha() and token.istitle():
+        return token.casefold()
+    return token
+
+
+def _join_expressions(tokens):
+    # "x^2 = 4" -> "x^2=4", without gluing words onto operators ("is -3" stays apart).
+    joined = []
+    for token in tokens:
+        previous = joined[-1] if joined else None
+        if previous and _is_math(previous) and _is_math(token) and (previous[-1] in _OPERATORS or token[0] in _OPERATORS):
+            joined[-1] = previous + token
+        else:
+            joined.append(token)
+    return joined
+
+
+def canonicalize(question):
+    """
+    Returns the canonical form of a question: unicode math symbols spelled out
+    (× -> *, x² -> x^2, √2 -> sqrt(2), ...), compatibility-normalized, with
+    whitespace around operators removed, trailing punctuation dropped, and a
+    trailing command ("x^2=4 solve") moved to the front. Case is kept, except
+    for a capitalized first word: "CO" is not "Co", nor "Mm" "mm".
+    """
+    text = question or ""
+    text = _SUPERSCRIPT_RE.sub(lambda m: "^" + m.group(0).translate(_SUPERSCRIPTS), text)
+    text = _SUBSCRIPT_RE.sub(lambda m: "_" + m.group(0).translate(_SUBSCRIPTS), text)
+    text = _ROOT_RE.sub(_root, text)
+    text = _SYMBOL_RE.sub(lambda m: _SYMBOLS[m.group(0)], text)
+    text = unicodedata.normalize("NFKC", text).rstrip("?.! \t\n")
+    words = _join_expressions([_fold(token, i == 0) for i, token in enumerate(text.split())])
+    if len(words) > 1 and words[-1] in _COMMANDS and words[0] not in _COMMANDS:
+        words.insert(0, words.pop())
+    return " ".join(words)
+
+
+def _split(canonical):
+    """
+    Splits a canonical question into its signature and its remaining words,
+    both in order. The signature holds whatever must match exactly:
+    expressions, numbers (also spelled out), variables, symbols and units of
+    up to two letters, anything not all lower case, and negations. Order is kept in both, so
+    "10 divided by 2" is not "2 divided by 10", nor "5 km to miles"
+    "5 miles to km".
+    """
+    math, words = [], []
+    for token in canonical.split(" "):
+        if not token or token in _STOPWORDS:
+            continue
+        if (
+            len(token) > 2 and token.isalpha() and token.islower()
+            and token not in _NEGATIONS and token not in _NUMBER_WORDS
+        ):
+            words.append(token)
+        else:
+            math.append(token)
+    return tuple(math), tuple(words)
+
+
+def _similarity(a, b, threshold):
+    # Similarity of two word sequences, by whole words and in order; 0 when certainly below threshold.
+    if a == b:
+        return 1.0
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+        return 0.0
+    return matcher.ratio()
+
+
+class QueryIndex:
+    """
+    Maps canonical questions onto previously seen ones that ask the same thing,
+    so that their answers share one cache entry. Candidates must have the same
+    signature; their remaining words are compared as ordered sequences of
+    whole words (difflib ratio) against threshold. Every merge is appended to the audit log.
+    """
+
+    # Candidates compared per math signature
+    BUCKET_SIZE = 64
+
+    def __init__(self, threshold, max_entries, audit_path=None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.audit_path = audit_path
+        self._lock = threading.Lock()
+        self._aliases = OrderedDict()  # canonical -> representative canonical
+        self._buckets = OrderedDict()  # math signature -> [(canonical, words), ...]
+        self._indexed = 0
+        self._audit_lock = threading.Lock()
+        self._stats = {"lookups": 0, "merges": 0}
+
+    def resolve(self, canonical):
+        """
+        Returns the representative for a canonical question: an earlier question
+        similar enough to it, or the question itself, which is then indexed.
+        """
+        with self._lock:
+            self._stats["lookups"] += 1
+            representative = self._aliases.get(canonical)
+            if representative is not None:
+                self._aliases.move_to_end(canonical)
+                return representative
+            signature, words = _split(canonical)
+            bucket = self._buckets.setdefault(signature, [])
+            self._buckets.move_to_end(signature)
+            best, best_score = None, 0.0
+            for candidate, candidate_words in bucket:
+                score = _similarity(words, candidate_words, self.threshold)
+                if score > best_score:
+                    best, best_score = candidate, score
+            if best is not None and best_score >= self.threshold:
+                representative = best
+                self._stats["merges"] += 1
+            else:
+                representative = canonical
+                bucket.append((canonical, words))
+                self._indexed += 1
+                if len(bucket) > self.BUCKET_SIZE:
+                    bucket.pop(0)
+                    self._indexed -= 1
+            self._aliases[canonical] = representative
+            while len(self._aliases) > self.max_entries:
+                self._aliases.popitem(last=False)
+            while self._indexed > self.max_entries:
+                _, evicted = self._buckets.popitem(last=False)
+                self._indexed -= len(evicted)
+        if representative != canonical:
+            self._audit(canonical, representative, best_score)
+        return representative
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._aliases)
+            stats["indexed"] = self._indexed
+        return stats
+
+    def _audit(self, canonical, representative, score):
+        logger.info("Merged query %r into %r (similarity %.2f)", canonical, representative, score)
+        if not self.audit_path:
+            return
+        line = json.dumps({"time": time.time(), "query": canonical, "merged_into": representative, "similarity": round(score, 3)})
+        with self._audit_lock:
+            try:
+                with open(self.audit_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.warning("Could not write query merge log %s: %s", self.audit_path, e)
+
+
+query_index = (
+    QueryIndex(QUERY_SIMILARITY_THRESHOLD, QUERY_INDEX_MAX_ENTRIES, QUERY_MERGE_LOG)
+    if QUERY_SIMILARITY_THRESHOLD > 0 else None
+)
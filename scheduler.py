@@ -0,0 +1,230 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+from config import (
+    WOLFRAM_RATE_LIMIT,
+    WOLFRAM_RATE_BURST,
+    SCHEDULER_MAX_QUEUE,
+    SCHEDULER_MAX_WAIT,
+    SCHEDULER_PRIORITIES,
+)
+
+
+class RateLimitedError(Exception):
+    """
+    Raised when an upstream call cannot be scheduled: the queue is full or the
+    wait for a token exceeded the limit. Routes answer it with 429.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Who the current request is on behalf of; set by the apps for each request
+_current_user = contextvars.ContextVar("scheduler_user", default="anonymous")
+
+
+def user_key(user_info, remote_addr=None):
+    """
+    Fair-queuing identity for a request: the signed-in Google user, else the client address.
+    """
+    if user_info:
+        return user_info.get("email") or user_info.get("sub") or "user"
+    return f"ip:{remote_addr or 'unknown'}"
+
+
+def set_current_user(key):
+    _current_user.set(key)
+
+
+class TokenBucket:
+    """
+    Allows rate operations per second on average with bursts of up to burst.
+    Not thread-safe; UpstreamScheduler guards it with its own lock.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def take(self):
+        """
+        Takes a token and returns 0, or returns the seconds until one is available.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("user", "priority", "enqueued", "granted", "notify")
+
+    def __init__(self, user, priority, notify):
+        self.user = user
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.notify = notify
+
+
+class UpstreamScheduler:
+    """
+    Admits upstream calls at the rate of a token bucket. Calls that find no
+    token wait in a bounded queue: lower priority values are served first and,
+    within a priority, users take turns (round robin), so one user's burst of
+    requests cannot hold everyone else back. A full queue or a wait longer
+    than max_wait raises RateLimitedError.
+    Shared by threads (acquire) and event loops (acquire_async) of one
+    process; each worker process has its own bucket and queue.
+    """
+
+    def __init__(self, rate, burst, max_queue, max_wait, priorities, default_priority=None):
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.priorities = dict(priorities)
+        self.default_priority = max(self.priorities.values(), default=0) if default_priority is None else default_priority
+        self._bucket = TokenBucket(rate, burst)
+        self._cond = threading.Condition()
+        self._levels = {}  # priority -> OrderedDict(user -> deque of waiters)
+        self._queued = 0
+        self._dispatcher = None
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+    def priority_for(self, mode):
+        return self.priorities.get(mode, self.default_priority)
+
+    def acquire(self, mode, user=None):
+        """
+        Blocks until the current request may call upstream for mode.
+        """
+        event = threading.Event()
+        waiter = self._enter(mode, user, event.set)
+        if waiter is None:
+            return
+        event.wait(self.max_wait)
+        self._leave(waiter)
+
+    async def acquire_async(self, mode, user=None):
+        """
+        asyncio counterpart of acquire(); waits without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enter(mode, user, notify)
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The request went away; give up the place in the queue.
+            with self._cond:
+                if not waiter.granted:
+                    self._remove(waiter)
+            raise
+        self._leave(waiter)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = {
+                priority: sum(len(waiters) for waiters in users.values())
+                for priority, users in sorted(self._levels.items())
+            }
+            stats["queued_now"] = self._queued
+        return stats
+
+    def _enter(self, mode, user, notify):
+        # Returns None when admitted straight away, else the queued waiter.
+        user = user or _current_user.get()
+        priority = self.priority_for(mode)
+        with self._cond:
+            if not self._queued and not self._bucket.take():
+                self._stats["admitted"] += 1
+                return None
+            if self._queued >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise RateLimitedError("Too many requests are waiting for the Wolfram|Alpha API; try again shortly.", self._retry_after())
+            waiter = _Waiter(user, priority, notify)
+            self._levels.setdefault(priority, OrderedDict()).setdefault(user, deque()).append(waiter)
+            self._queued += 1
+            self._stats["queued"] += 1
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="upstream-scheduler", daemon=True)
+                self._dispatcher.start()
+            self._cond.notify()
+        return waiter
+
+    def _leave(self, waiter):
+        with self._cond:
+            granted = waiter.granted
+            if not granted:
+                self._remove(waiter)
+                self._stats["timeouts"] += 1
+        metrics.scheduler_wait.observe(time.monotonic() - waiter.enqueued, str(waiter.priority))
+        if not granted:
+            raise RateLimitedError("Timed out waiting for a Wolfram|Alpha API slot; try again shortly.", self._retry_after())
+
+    def _retry_after(self):
+        # Rough time for the current queue to drain at the bucket rate.
+        return max(1, int(self._queued / self._bucket.rate) + 1)
+
+    def _remove(self, waiter):
+        users = self._levels.get(waiter.priority, {})
+        waiters = users.get(waiter.user)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del users[waiter.user]
+        self._queued -= 1
+
+    def _next_waiter(self):
+        for priority in sorted(self._levels):
+            users = self._levels[priority]
+            if not users:
+                continue
+            user, waiters = users.popitem(last=False)
+            waiter = waiters.popleft()
+            if waiters:
+                users[user] = waiters  # back of the line for this user's next request
+            self._queued -= 1
+            return waiter
+        return None
+
+    def _dispatch(self):
+        with self._cond:
+            while True:
+                if not self._queued:
+                    self._cond.wait()
+                    continue
+                wait = self._bucket.take()
+                if wait:
+                    self._cond.wait(wait)
+                    continue
+                waiter = self._next_waiter()
+                waiter.granted = True
+                self._stats["admitted"] += 1
+                waiter.notify()
+
+
+scheduler = (
+    UpstreamScheduler(WOLFRAM_RATE_LIMIT, WOLFRAM_RATE_BURST, SCHEDULER_MAX_QUEUE, SCHEDULER_MAX_WAIT, SCHEDULER_PRIORITIES)
+    if WOLFRAM_RATE_LIMIT > 0 else None
+)
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "value", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into one execution. The first
+    caller runs the function; callers arriving while it is in flight block and
+    receive the same result, or have the same exception re-raised.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"calls": 0, "executions": 0, "collapsed": 0}
+
+    def do(self, key, func):
+        call, leader = self.begin(key)
+        if not leader:
+            return self.wait(call)
+        try:
+            value = func()
+        except BaseException as e:
+            self.end(key, call, error=e)
+            raise
+        self.end(key, call, value)
+        return value
+
+    def begin(self, key):
+        """
+        Lower-level half of do() for callers that cannot wrap their work in a
+        function, such as generators. Returns (call, leader): the leader must
+        end() the call, everyone else waits for it with wait(call).
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["collapsed"] += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self._stats["executions"] += 1
+            return call, True
+
+    def end(self, key, call, value=None, error=None):
+        call.value = value
+        call.error = error
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    @staticmethod
+    def wait(call):
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight for coroutine functions. Must be used
+    from a single event loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {"calls": 0, "executions": 0, "collapsed": 0}
+
+    async def do(self, key, func):
+        future, leader = self.begin(key)
+        if not leader:
+            return await asyncio.shield(future)
+        try:
+            value = await func()
+        except BaseException as e:
+            self.end(key, future, error=e)
+            raise
+        self.end(key, future, value)
+        return value
+
+    def begin(self, key):
+        """
+        Async counterpart of SingleFlight.begin; followers await
+        asyncio.shield(future) instead of calling wait().
+        """
+        self._stats["calls"] += 1
+        future = self._calls.get(key)
+        if future is not None:
+            self._stats["collapsed"] += 1
+            return future, False
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self._stats["executions"] += 1
+        return future, True
+
+    def end(self, key, future, value=None, error=None):
+        del self._calls[key]
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+            # Mark the exception as retrieved in case nobody else was waiting.
+            future.exception()
+        else:
+            future.set_result(value)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._calls)
+        return stats
+
+
+wolfram_flight = SingleFlight()
+wolfram_async_flight = AsyncSingleFlight()
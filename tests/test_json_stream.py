@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from json_stream import StreamingArrayParser
+
+DOCUMENT = {
+    "queryresult": {
+        "success": True,
+        "pods": [
+            {"title": "Input", "id": "Input", "subpods": [{"plaintext": "x^2 = 4"}]},
+            {"title": "Say \"hi\" {not a brace} [nor this]", "id": "Quoted", "subpods": []},
+            {"title": "Back\\slash", "id": "Escapes", "subpods": [{"plaintext": "a\\\"}b\\\\"}]},
+            {"title": "Ünïcödé → ∞", "id": "Unicode", "states": [{"name": "More"}], "subpods": []},
+        ],
+        "assumptions": {"type": "Clash", "values": ["a", "b"]},
+    }
+}
+
+
+def _parse(chunks, key="pods"):
+    parser = StreamingArrayParser(key)
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items, parser.finish()
+
+
+def _split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1 << 20])
+def test_pods_split_across_chunks(size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False).encode("utf-8")
+    items, rest = _parse(_split(data, size))
+    assert items == DOCUMENT["queryresult"]["pods"]
+    assert rest == {"queryresult": dict(DOCUMENT["queryresult"], pods=[])}
+
+
+def test_elements_are_returned_as_soon_as_they_end():
+    parser = StreamingArrayParser("pods")
+    assert parser.feed('{"pods": [{"id": "a", "s": "}"}, {"id": "b"') == [{"id": "a", "s": "}"}]
+    assert parser.feed(', "t": "\\"]"}') == [{"id": "b", "t": '"]'}]
+    assert parser.feed("]}") == []
+    assert parser.finish() == {"pods": []}
+
+
+def test_escape_at_chunk_boundary():
+    items, _ = _parse(['{"pods": [{"s": "a\\', '"b"}]}'])
+    assert items == [{"s": 'a"b'}]
+
+
+def test_scalar_elements():
+    items, rest = _parse(['{"pods": [1', '2, "x,]", true, null ,[3, {"y": []}]], "n": 1}'])
+    assert items == [12, "x,]", True, None, [3, {"y": []}]]
+    assert rest == {"pods": [], "n": 1}
+
+
+def test_key_inside_string_is_not_matched():
+    items, rest = _parse(['{"note": "\\"pods\\": [1]", "pods": [{"a": 1}]}'])
+    assert items == [{"a": 1}]
+    assert rest == {"note": '"pods": [1]', "pods": []}
+
+
+def test_incomplete_document():
+    parser = StreamingArrayParser("pods")
+    parser.feed('{"pods": [{"a": 1}, {"b"')
+    with pytest.raises(ValueError):
+        parser.finish()
+
+
+def test_malformed_element():
+    parser = StreamingArrayParser("pods")
+    with pytest.raises(ValueError):
+        parser.feed('{"pods": [{"a": }]}')
+
+
+def _stream_ids(pods):
+    from wolfram_api import _FullResultsStream
+
+    stream = _FullResultsStream()
+    data = json.dumps({"queryresult": {"success": True, "pods": pods}})
+    sent = [[event["pod"].id for event in stream.feed(chunk)] for chunk in _split(data, 16)]
+    return [ids for ids in sent if ids], [event["type"] for event in stream.finish()]
+
+
+def test_full_results_stream_primary_pod_first():
+    pods = [{"id": str(i), "title": str(i), "subpods": []} for i in range(4)]
+    pods[1]["primary"] = True
+    sent, rest = _stream_ids(pods)
+    assert sent == [["1", "0"], ["2"], ["3"]]
+    assert rest == ["result"]
+
+
+def test_full_results_stream_without_primary_pod_is_not_held():
+    pods = [{"id": str(i), "title": str(i), "subpods": []} for i in range(6)]
+    sent, rest = _stream_ids(pods)
+    assert sent == [["0", "1", "2"], ["3"], ["4"], ["5"]]
+    assert rest == ["result"]
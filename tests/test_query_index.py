@@ -0,0 +1,52 @@
+import pytest
+
+from query_index import QueryIndex, canonicalize
+
+
+def _merged(a, b, threshold=0.9):
+    index = QueryIndex(threshold, 100)
+    first = index.resolve(canonicalize(a))
+    return index.resolve(canonicalize(b)) == first
+
+
+@pytest.mark.parametrize("a, b", [
+    ("10 divided by 2", "2 divided by 10"),
+    ("convert 5 miles to km", "convert 5 km to miles"),
+    ("integrate x^2 from 0 to 1", "integrate x^2 from 1 to 0"),
+    ("how many seconds in a day", "how many days in a second"),
+    ("molar mass of CO", "molar mass of Co"),
+    ("molar mass of CO", "molar mass of CU"),
+    ("100 Mm to km", "100 mm to km"),
+    ("is 7 prime", "is 7 not prime"),
+    ("boiling point of methanol", "boiling point of ethanol"),
+    ("integrate a dx", "integrate dx"),
+    ("population of the united states in the year two thousand",
+     "population of the united states in the year two thousand ten"),
+])
+def test_different_questions_are_not_merged(a, b):
+    assert canonicalize(a) != canonicalize(b)
+    assert not _merged(a, b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("molar mass of CO", "molar mass of Co"),
+    ("100 Mm to km", "100 mm to km"),
+])
+def test_case_is_kept_without_similarity_index(a, b):
+    assert canonicalize(a) != canonicalize(b)
+    assert not _merged(a, b, threshold=0)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("Solve x² = 4?", "x^2=4 solve"),
+    ("what is the derivative of sin(x)", "sin(x) derivative"),
+    ("What is the derivative of sin(x)", "derivative of sin(x)"),
+])
+def test_same_questions_are_merged(a, b):
+    assert _merged(a, b)
+
+
+def test_canonical_forms():
+    assert canonicalize("Solve x² = 4?") == "solve x^2=4"
+    assert canonicalize("√2 × 3") == "sqrt(2)*3"
+    assert canonicalize("molar mass of CO") == "molar mass of CO"
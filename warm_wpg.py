@@ -0,0 +1,59 @@
+"""
+Pre-fetches the WPG topic catalog and question pools into the local store
+(WPG_STORE_PATH), so practice test pages are served without calling Quezzio.
+Run it from cron or before starting the backend, e.g.:
+
+    python warm_wpg.py                          # catalog + every topic at every difficulty
+    python warm_wpg.py --topics-only
+    python warm_wpg.py --topic "Linear Equations" --difficulty Beginner --pool-size 50
+"""
+import argparse
+import logging
+import sys
+
+from dotenv import load_dotenv
+
+# Load .env variables before config reads them at import time
+load_dotenv()
+
+from wpg_client import WPGError
+import wpg_store as store_module
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topics-only", action="store_true", help="only refresh the topic catalog")
+    parser.add_argument("--topic", action="append", help="warm only this topic (repeatable); default: the whole catalog")
+    parser.add_argument("--difficulty", action="append", choices=store_module.DIFFICULTIES, help="repeatable; default: all")
+    parser.add_argument("--answer-type", default=store_module.DEFAULT_ANSWER_TYPE)
+    parser.add_argument("--pool-size", type=int, help="questions kept per pool (default: WPG_POOL_SIZE)")
+    parser.add_argument("--batch-size", type=int, default=10, help="pools requested per Quezzio call")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    store = store_module.wpg_store
+    if store is None:
+        sys.exit("WPG_STORE_PATH is empty; the local WPG store is disabled.")
+    if args.pool_size:
+        store.pool_size = args.pool_size
+
+    try:
+        filled = store.warm(
+            topics=args.topic,
+            difficulties=args.difficulty or store_module.DIFFICULTIES,
+            answer_type=args.answer_type,
+            batch_size=args.batch_size,
+            questions=not args.topics_only,
+        )
+    except (WPGError, ValueError) as e:
+        sys.exit(f"Warm-up failed: {e}")
+    stats = store.stats()
+    print(f"Stored the topic catalog and {filled} question pools in {store.path} "
+          f"({stats['pools']} pools, {stats['questions']} questions in total)")
+
+
+if __name__ == "__main__":
+    main()
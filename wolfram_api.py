@@ -1,15 +1,135 @@
+import functools
+import inspect
+import time
 import requests
 from urllib.parse import urlencode
-from config import WOLFRAM_API_URLS, WOLFRAM_APPID
+from config import WOLFRAM_API_URLS, WOLFRAM_APPID, STREAM_CHUNK_SIZE
+import http_client
+import metrics
+from json_stream import StreamingArrayParser
+from models import QueryResult, Pod
+from cache import make_key, response_cache
+from singleflight import wolfram_flight
+from scheduler import scheduler
+from degradation import degradation
 
 class WolframAPIError(Exception):
     pass
 
-def query_short_answer(question, units=None, timeout=None):
+
+class CircuitOpenError(WolframAPIError):
     """
-    Calls the Wolfram|Alpha Short Answers API and returns the result as plain text.
-    Raises WolframAPIError on failure.
+    Raised instead of calling an endpoint whose circuit breaker is open.
+    """
+
+
+# Upstream endpoint -> answer mode, used to label upstream metrics
+_ENDPOINT_MODES = {
+    WOLFRAM_API_URLS["short_answers"]: "short_answer",
+    WOLFRAM_API_URLS["spoken_results"]: "spoken_result",
+    WOLFRAM_API_URLS["simple"]: "simple",
+    WOLFRAM_API_URLS["full_results"]: "full",
+    WOLFRAM_API_URLS["llm"]: "llm",
+}
+
+
+def _endpoint(url, params):
+    # Name the degradation policy tracks a call under; plaintext-only Full Results
+    # calls are much cheaper than full ones, so they are tracked on their own.
+    mode = _ENDPOINT_MODES.get(url, "other")
+    if mode == "full" and params.get("format") == "plaintext":
+        return "full_plaintext"
+    return mode
+
+
+def _admit(url, params):
+    """
+    Returns the endpoint name of an upstream call about to be made, or raises
+    CircuitOpenError if the degradation policy has opened its circuit.
+    """
+    endpoint = _endpoint(url, params)
+    if degradation is not None and not degradation.allow(endpoint):
+        raise CircuitOpenError(f"Wolfram|Alpha {endpoint} API is failing; try again shortly.")
+    return endpoint
+
+
+def _record(endpoint, status, seconds):
+    if degradation is not None:
+        degradation.record(endpoint, status, seconds)
+
+
+def _get(url, params, **kwargs):
+    """
+    Sends a GET through the shared pooled client, once the scheduler (if
+    enabled) admits it; RateLimitedError propagates when it does not.
+    Connection failures, timeouts and exhausted retries are raised as WolframAPIError,
+    and calls to an endpoint with an open circuit as CircuitOpenError.
+    """
+    mode = _ENDPOINT_MODES.get(url, "other")
+    if scheduler is not None:
+        with metrics.phase("queue"):
+            scheduler.acquire(mode)
+    endpoint = _admit(url, params)
+    started = time.perf_counter()
+    with metrics.upstream(mode) as call:
+        try:
+            response = http_client.get(url, params=params, **kwargs)
+            call.status = response.status_code
+        except requests.Timeout:
+            call.status = "timeout"
+            raise WolframAPIError("Wolfram|Alpha API timed out.")
+        except requests.RequestException as e:
+            # The exception text embeds the request URL (and therefore the AppID), so only the type is surfaced.
+            raise WolframAPIError(f"Failed to reach Wolfram|Alpha API ({type(e).__name__}).")
+        finally:
+            _record(endpoint, call.status, time.perf_counter() - started)
+        return response
+
+
+def _cached(mode):
+    """
+    Serves repeated queries from the response cache. The key covers the mode and
+    every argument of the wrapped function; errors are never cached.
+    On a miss, concurrent callers with the same key share a single upstream call.
+    The wrapper's is_cached(*args, **kwargs) tells whether a call would be a hit.
     """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def cache_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return make_key(mode, bound.arguments)
+
+        def is_cached(*args, **kwargs):
+            return response_cache.contains(cache_key(args, kwargs), mode)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = cache_key(args, kwargs)
+            with metrics.phase("cache"):
+                hit, value = response_cache.get(key, mode)
+            metrics.mark("cache", "hit" if hit else "miss")
+            if hit:
+                return value
+
+            def fetch():
+                # A previous leader may have filled the cache since our lookup.
+                found, result = response_cache.get(key, mode, count=False)
+                if found:
+                    return result
+                result = func(*args, **kwargs)
+                response_cache.set(key, mode, result)
+                return result
+
+            return wolfram_flight.do(key, fetch)
+
+        wrapper.is_cached = is_cached
+        return wrapper
+    return decorator
+
+
+def _short_answer_request(question, units=None, timeout=None):
     params = {
         "appid": WOLFRAM_APPID,
         "i": question,
@@ -19,9 +139,10 @@ def query_short_answer(question, units=None, timeout=None):
     if timeout:
         params["timeout"] = timeout
 
-    url = WOLFRAM_API_URLS["short_answers"]
-    response = requests.get(url, params=params)
+    return WOLFRAM_API_URLS["short_answers"], params
+
 
+def _short_answer_result(response):
     if response.status_code == 200:
         return response.text.strip()
     elif response.status_code == 501:
@@ -36,11 +157,17 @@ def query_short_answer(question, units=None, timeout=None):
         raise WolframAPIError(f"Unexpected error: {response.status_code} - {response.text}")
 
 
-def query_spoken_result(question, units=None, timeout=None):
+@_cached("short_answer")
+def query_short_answer(question, units=None, timeout=None):
     """
-    Calls the Wolfram|Alpha Spoken Results API and returns the result as plain text.
+    Calls the Wolfram|Alpha Short Answers API and returns the result as plain text.
     Raises WolframAPIError on failure.
     """
+    url, params = _short_answer_request(question, units, timeout)
+    return _short_answer_result(_get(url, params))
+
+
+def _spoken_result_request(question, units=None, timeout=None):
     params = {
         "appid": WOLFRAM_APPID,
         "i": question,
@@ -50,9 +177,10 @@ def query_spoken_result(question, units=None, timeout=None):
     if timeout:
         params["timeout"] = timeout
 
-    url = WOLFRAM_API_URLS["spoken_results"]
-    response = requests.get(url, params=params)
+    return WOLFRAM_API_URLS["spoken_results"], params
+
 
+def _spoken_result_result(response):
     if response.status_code == 200:
         return response.text.strip()
     elif response.status_code == 501:
@@ -67,7 +195,17 @@ def query_spoken_result(question, units=None, timeout=None):
         raise WolframAPIError(f"Unexpected error: {response.status_code} - {response.text}")
 
 
-def query_simple_api(
+@_cached("spoken_result")
+def query_spoken_result(question, units=None, timeout=None):
+    """
+    Calls the Wolfram|Alpha Spoken Results API and returns the result as plain text.
+    Raises WolframAPIError on failure.
+    """
+    url, params = _spoken_result_request(question, units, timeout)
+    return _spoken_result_result(_get(url, params))
+
+
+def _simple_request(
     question,
     units=None,
     timeout=None,
@@ -77,10 +215,6 @@ def query_simple_api(
     fontsize=None,
     width=None,
 ):
-    """
-    Calls the Wolfram|Alpha Simple API and returns the image content (bytes).
-    Raises WolframAPIError on failure.
-    """
     params = {
         "appid": WOLFRAM_APPID,
         "i": question,
@@ -100,9 +234,10 @@ def query_simple_api(
     if width:
         params["width"] = width
 
-    url = WOLFRAM_API_URLS["simple"]
-    response = requests.get(url, params=params, stream=True)
+    return WOLFRAM_API_URLS["simple"], params
+
 
+def _simple_result(response):
     if response.status_code == 200 and "image" in response.headers.get("Content-Type", ""):
         return response.content  # return raw image bytes
     elif response.status_code == 501:
@@ -117,7 +252,63 @@ def query_simple_api(
         raise WolframAPIError(f"Unexpected error: {response.status_code} - {response.text}")
 
 
-def query_full_results(
+@_cached("simple")
+def query_simple_api(
+    question,
+    units=None,
+    timeout=None,
+    layout=None,
+    background=None,
+    foreground=None,
+    fontsize=None,
+    width=None,
+):
+    """
+    Calls the Wolfram|Alpha Simple API and returns the image content (bytes).
+    Raises WolframAPIError on failure.
+    """
+    url, params = _simple_request(question, units, timeout, layout, background, foreground, fontsize, width)
+    return _simple_result(_get(url, params, stream=True))
+
+
+def stream_simple_api(
+    question,
+    units=None,
+    timeout=None,
+    layout=None,
+    background=None,
+    foreground=None,
+    fontsize=None,
+    width=None,
+):
+    """
+    Streaming variant of query_simple_api. Yields the image content type first, then
+    the image body in chunks of STREAM_CHUNK_SIZE bytes, so memory per request is
+    bounded by the chunk size rather than the image size.
+    Raises WolframAPIError on failure; errors before the content type cover all
+    non-image responses.
+    """
+    url, params = _simple_request(question, units, timeout, layout, background, foreground, fontsize, width)
+    response = _get(url, params, stream=True)
+    with response:
+        content_type = response.headers.get("Content-Type", "")
+        if response.status_code != 200 or "image" not in content_type:
+            _simple_result(response)
+        yield content_type
+        try:
+            yield from response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        except requests.RequestException as e:
+            raise WolframAPIError(f"Failed to read Wolfram|Alpha API response ({type(e).__name__}).")
+
+
+# Output formats the Full Results API can return for each subpod
+FULL_RESULTS_FORMATS = [
+    "plaintext", "image", "imagemap", "mathml", "moutput", "minput",
+    "cell", "sound", "wav"
+]
+
+
+def _full_results_request(
     question,
     units=None,
     timeout=None,
@@ -126,26 +317,17 @@ def query_full_results(
     excludepodid=None,
     podstate=None
 ):
-    """
-    Calls the Wolfram|Alpha Full Results API and returns a structured dictionary with all available information
-    for each pod and subpod: plaintext, image, imagemap, mathml, sound, wav, minput, moutput, cell, states, infos, etc.
-    Always requests all available output formats from the API.
-    """
     params = {
         "appid": WOLFRAM_APPID,
         "input": question,
         "output": "JSON"
     }
     # Always request all useful formats unless overridden
-    default_formats = [
-        "plaintext", "image", "imagemap", "mathml", "moutput", "minput",
-        "cell", "sound", "wav"
-    ]
     if formats:
         # Use caller-provided formats if present
         params["format"] = ",".join(formats)
     else:
-        params["format"] = ",".join(default_formats)
+        params["format"] = ",".join(FULL_RESULTS_FORMATS)
 
     # Optional parameters
     if units:
@@ -171,71 +353,246 @@ def query_full_results(
         else:
             params["podstate"] = podstate
 
-    url = WOLFRAM_API_URLS["full_results"]
-    response = requests.get(url, params=params)
+    return WOLFRAM_API_URLS["full_results"], params
+
+
+def _shape_queryresult(queryresult):
+    if not queryresult.get("success", False):
+        raise WolframAPIError("Query not understood or no results found.")
+    return QueryResult.from_api(queryresult)
+
+
+def _full_results_result(response):
     if response.status_code != 200:
         raise WolframAPIError(f"Full Results API error: {response.status_code} - {response.text}")
 
-    data = response.json()
+    with metrics.phase("parse"):
+        data = response.json()
     try:
-        queryresult = data["queryresult"]
-        if not queryresult.get("success", False):
-            raise WolframAPIError("Query not understood or no results found.")
+        with metrics.phase("reshape"):
+            return _shape_queryresult(data["queryresult"])
+    except Exception as e:
+        raise WolframAPIError(f"Failed to parse Full Results API response: {e}")
+
 
-        pods = queryresult.get("pods", [])
-        results = []
+class _FullResultsStream:
+    """
+    Turns chunks of a Full Results response body into stream events as pods
+    are parsed: {"type": "pod", "pod": ...} for each pod, then a final
+    {"type": "result", "result": ...} with everything but the pods. Up to
+    MAX_HELD pods are held back so that a primary pod among the first few
+    goes out first; beyond that, pods stream in upstream order.
+    The assembled full result is left in .result for caching.
+    """
 
+    MAX_HELD = 2
+
+    def __init__(self):
+        self._parser = StreamingArrayParser("pods")
+        self._held = []
+        self._primary_seen = False
+        self._pods = []
+        self.result = None
+
+    def feed(self, chunk):
+        events = []
+        try:
+            pods = self._parser.feed(chunk)
+        except Exception as e:
+            raise WolframAPIError(f"Failed to parse Full Results API response: {e}")
         for pod in pods:
-            pod_info = {
-                "title": pod.get("title"),
-                "id": pod.get("id"),
-                "primary": pod.get("primary", False),
-                "scanner": pod.get("scanner"),
-                "position": pod.get("position"),
-                "subpods": [],
-                "states": pod.get("states", []),
-                "infos": pod.get("infos", []),
-            }
-            for sub in pod.get("subpods", []):
-                subpod_info = {
-                    "title": sub.get("title", ""),
-                    "plaintext": sub.get("plaintext"),
-                    "img": sub.get("img", {}),
-                    "imagemap": sub.get("imagemap", {}),
-                    "mathml": sub.get("mathml"),
-                    "sound": sub.get("sound", {}),
-                    "wav": sub.get("wav", {}),
-                    "minput": sub.get("minput"),
-                    "moutput": sub.get("moutput"),
-                    "cell": sub.get("cell"),
-                    "states": sub.get("states", []),
-                }
-                pod_info["subpods"].append(subpod_info)
-            results.append(pod_info)
-
-        # Include assumptions, warnings, sources, and generalizations if present
-        extra = {}
-        for key in ("assumptions", "warnings", "sources", "generalizations"):
-            if key in queryresult:
-                extra[key] = queryresult[key]
-
-        return {
-            "success": queryresult.get("success", False),
-            "error": queryresult.get("error", False),
-            "numpods": queryresult.get("numpods", 0),
-            "datatypes": queryresult.get("datatypes", ""),
-            "pods": results,
-            **extra
-        }
+            pod = Pod.from_api(pod)
+            self._pods.append(pod)
+            if self._primary_seen:
+                events.append(_pod_event(pod))
+            elif pod.primary:
+                # Hold earlier pods back until the primary one has gone out.
+                self._primary_seen = True
+                events.append(_pod_event(pod))
+                events.extend(_pod_event(held) for held in self._held)
+                self._held = []
+            else:
+                self._held.append(pod)
+                if len(self._held) > self.MAX_HELD:
+                    # No primary pod early on; stop waiting for one.
+                    self._primary_seen = True
+                    events.extend(_pod_event(held) for held in self._held)
+                    self._held = []
+        return events
+
+    def finish(self):
+        try:
+            summary = _shape_queryresult(self._parser.finish()["queryresult"])
+        except Exception as e:
+            raise WolframAPIError(f"Failed to parse Full Results API response: {e}")
+        events = [_pod_event(held) for held in self._held]
+        self._held = []
+        summary.pods = self._pods
+        self.result = summary
+        events.append(_result_event(summary))
+        return events
+
+
+def _pod_event(pod):
+    return {"type": "pod", "pod": pod}
+
+
+def _result_event(full_result):
+    return {"type": "result", "result": full_result.to_dict(include_pods=False)}
+
+
+def _full_results_events(full_result):
+    """
+    Replays an already assembled full result as stream events, primary pod first.
+    """
+    for pod in sorted(full_result.pods, key=lambda pod: not pod.primary):
+        yield _pod_event(pod)
+    yield _result_event(full_result)
+
+
+def _full_results_key(question, units, timeout, formats, includepodid, excludepodid, podstate):
+    # Same key query_full_results is cached under, so both share entries.
+    return make_key("full", {
+        "question": question,
+        "units": units,
+        "timeout": timeout,
+        "formats": formats,
+        "includepodid": includepodid,
+        "excludepodid": excludepodid,
+        "podstate": podstate,
+    })
+
+
+@_cached("full")
+def query_full_results(
+    question,
+    units=None,
+    timeout=None,
+    formats=None,
+    includepodid=None,
+    excludepodid=None,
+    podstate=None
+):
+    """
+    Calls the Wolfram|Alpha Full Results API and returns a QueryResult with all available information
+    for each pod and subpod: plaintext, image, imagemap, mathml, sound, wav, minput, moutput, cell, states, infos, etc.
+    Always requests all available output formats from the API.
+    """
+    url, params = _full_results_request(question, units, timeout, formats, includepodid, excludepodid, podstate)
+    return _full_results_result(_get(url, params))
+
+
+def stream_full_results(
+    question,
+    units=None,
+    timeout=None,
+    formats=None,
+    includepodid=None,
+    excludepodid=None,
+    podstate=None
+):
+    """
+    Streaming variant of query_full_results. Yields each pod as soon as it has been
+    parsed from the upstream body (primary pod first), then a final result event
+    with success, numpods, assumptions, etc. Served from and stored into the same
+    cache entry as query_full_results, and coalesced with concurrent calls of either
+    for the same key: those wait for the one upstream call and replay its result.
+    Raises WolframAPIError on failure, possibly after some pods have been yielded.
+    """
+    args = (question, units, timeout, formats, includepodid, excludepodid, podstate)
+    key = _full_results_key(*args)
+    hit, cached = response_cache.get(key, "full")
+    metrics.mark("cache", "hit" if hit else "miss")
+    if hit:
+        yield from _full_results_events(cached)
+        return
+
+    call, leader = wolfram_flight.begin(key)
+    if not leader:
+        result = wolfram_flight.wait(call)
+        if result is None:
+            # The leading stream was abandoned before it completed.
+            result = query_full_results(*args)
+        yield from _full_results_events(result)
+        return
+    try:
+        result = yield from _stream_full_results(key, args)
     except Exception as e:
-        raise WolframAPIError(f"Failed to parse Full Results API response: {e}")
+        wolfram_flight.end(key, call, error=e)
+        raise
+    except BaseException:
+        wolfram_flight.end(key, call)
+        raise
+    wolfram_flight.end(key, call, result)
 
 
-def query_llm_api(question, maxchars=None):
+def _stream_full_results(key, args):
+    # A previous leader may have filled the cache since our lookup.
+    found, cached = response_cache.get(key, "full", count=False)
+    if found:
+        yield from _full_results_events(cached)
+        return cached
+
+    url, params = _full_results_request(*args)
+    response = _get(url, params, stream=True)
+    with response:
+        if response.status_code != 200:
+            raise WolframAPIError(f"Full Results API error: {response.status_code} - {response.text}")
+        stream = _FullResultsStream()
+        try:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                yield from stream.feed(chunk)
+        except requests.RequestException as e:
+            raise WolframAPIError(f"Failed to read Wolfram|Alpha API response ({type(e).__name__}).")
+        yield from stream.finish()
+    response_cache.set(key, "full", stream.result)
+    return stream.result
+
+
+def _pod_index(full_result):
     """
-    Calls the Wolfram|Alpha LLM API and returns the result as plain text.
-    Raises WolframAPIError on failure.
+    Reduces a plaintext-only full result to the pod index: titles, ids,
+    positions, available pod states and subpod plaintext.
+    """
+    return full_result.to_dict(fields=("plaintext",))
+
+
+def _select_pod(full_result, podid):
+    for pod in full_result.pods:
+        if pod.id == podid:
+            return pod
+    raise WolframAPIError(f"Pod not found: {podid}")
+
+
+def query_pod_index(question, units=None, timeout=None):
+    """
+    Lightweight first phase of lazy Full Results loading: returns every pod's title,
+    id, position and subpod plaintext without the heavy formats.
+    Fetch a pod's full content with query_pod.
+    """
+    full_result = query_full_results(question, units=units, timeout=timeout, formats=["plaintext"])
+    return _pod_index(full_result)
+
+
+def query_pod(question, podid, podstate=None, formats=None, units=None, timeout=None):
     """
+    Second phase of lazy Full Results loading: fetches a single pod (by its id from
+    query_pod_index) with all output formats, or only the given ones. podstate
+    selects an alternate pod state, e.g. "Step-by-step solution".
+    Raises WolframAPIError on failure or if the pod is not in the result.
+    """
+    full_result = query_full_results(
+        question,
+        units=units,
+        timeout=timeout,
+        formats=formats,
+        includepodid=podid,
+        podstate=podstate,
+    )
+    return _select_pod(full_result, podid)
+
+
+def _llm_request(question, maxchars=None):
     params = {
         "appid": WOLFRAM_APPID,
         "input": question,
@@ -243,8 +600,10 @@ def query_llm_api(question, maxchars=None):
     if maxchars:
         params["maxchars"] = maxchars
 
-    url = WOLFRAM_API_URLS["llm"]
-    response = requests.get(url, params=params)
+    return WOLFRAM_API_URLS["llm"], params
+
+
+def _llm_result(response):
     if response.status_code == 200:
         return response.text.strip()
     elif response.status_code == 501:
@@ -259,4 +618,24 @@ def query_llm_api(question, maxchars=None):
         else:
             raise WolframAPIError("Forbidden: Check your AppID and configuration.")
     else:
-        raise WolframAPIError(f"Unexpected error: {response.status_code} - {response.text}")
\ No newline at end of file
+        raise WolframAPIError(f"Unexpected error: {response.status_code} - {response.text}")
+
+
+@_cached("llm")
+def query_llm_api(question, maxchars=None):
+    """
+    Calls the Wolfram|Alpha LLM API and returns the result as plain text.
+    Raises WolframAPIError on failure.
+    """
+    url, params = _llm_request(question, maxchars)
+    return _llm_result(_get(url, params))
+
+
+# /ask answer modes and the query function serving each
+MODES = {
+    "short_answer": query_short_answer,
+    "spoken_result": query_spoken_result,
+    "simple": query_simple_api,
+    "full": query_full_results,
+    "llm": query_llm_api,
+}
@@ -0,0 +1,299 @@
+"""
+asyncio versions of the wolfram_api query functions, used by the ASGI app (asgi.py).
+Request building and response handling are shared with wolfram_api, and so is
+the response cache, so both serving paths see each other's cached answers.
+"""
+import asyncio
+import functools
+import inspect
+import time
+
+import httpx
+
+import async_http_client
+import metrics
+from cache import make_key, response_cache
+from config import STREAM_CHUNK_SIZE
+from scheduler import scheduler
+from singleflight import wolfram_async_flight
+from wolfram_api import (
+    WolframAPIError,
+    _ENDPOINT_MODES,
+    _admit,
+    _record,
+    _short_answer_request,
+    _short_answer_result,
+    _spoken_result_request,
+    _spoken_result_result,
+    _simple_request,
+    _simple_result,
+    _full_results_request,
+    _full_results_result,
+    _full_results_key,
+    _full_results_events,
+    _FullResultsStream,
+    _pod_index,
+    _select_pod,
+    _llm_request,
+    _llm_result,
+)
+
+
+async def _get(url, params):
+    """
+    Sends a GET through the shared async client, once the scheduler (if
+    enabled) admits it; RateLimitedError propagates when it does not.
+    Connection failures, timeouts and exhausted retries are raised as WolframAPIError,
+    and calls to an endpoint with an open circuit as CircuitOpenError.
+    """
+    mode = _ENDPOINT_MODES.get(url, "other")
+    await _acquire(mode)
+    endpoint = _admit(url, params)
+    started = time.perf_counter()
+    with metrics.upstream(mode) as call:
+        try:
+            response = await async_http_client.get(url, params=params)
+            call.status = response.status_code
+        except httpx.TimeoutException:
+            call.status = "timeout"
+            raise WolframAPIError("Wolfram|Alpha API timed out.")
+        except httpx.HTTPError as e:
+            raise WolframAPIError(f"Failed to reach Wolfram|Alpha API ({type(e).__name__}).")
+        finally:
+            _record(endpoint, call.status, time.perf_counter() - started)
+        return response
+
+
+async def _acquire(mode):
+    if scheduler is not None:
+        with metrics.phase("queue"):
+            await scheduler.acquire_async(mode)
+
+
+def _cached(mode):
+    """
+    Async counterpart of wolfram_api._cached: cache lookup, then a single shared
+    upstream call per key among concurrent callers.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def cache_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return make_key(mode, bound.arguments)
+
+        def is_cached(*args, **kwargs):
+            return response_cache.contains(cache_key(args, kwargs), mode)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = cache_key(args, kwargs)
+            with metrics.phase("cache"):
+                hit, value = response_cache.get(key, mode)
+            metrics.mark("cache", "hit" if hit else "miss")
+            if hit:
+                return value
+
+            async def fetch():
+                # A previous leader may have filled the cache since our lookup.
+                found, result = response_cache.get(key, mode, count=False)
+                if found:
+                    return result
+                result = await func(*args, **kwargs)
+                response_cache.set(key, mode, result)
+                return result
+
+            return await wolfram_async_flight.do(key, fetch)
+
+        wrapper.is_cached = is_cached
+        return wrapper
+    return decorator
+
+
+@_cached("short_answer")
+async def query_short_answer(question, units=None, timeout=None):
+    url, params = _short_answer_request(question, units, timeout)
+    return _short_answer_result(await _get(url, params))
+
+
+@_cached("spoken_result")
+async def query_spoken_result(question, units=None, timeout=None):
+    url, params = _spoken_result_request(question, units, timeout)
+    return _spoken_result_result(await _get(url, params))
+
+
+@_cached("simple")
+async def query_simple_api(
+    question,
+    units=None,
+    timeout=None,
+    layout=None,
+    background=None,
+    foreground=None,
+    fontsize=None,
+    width=None,
+):
+    url, params = _simple_request(question, units, timeout, layout, background, foreground, fontsize, width)
+    return _simple_result(await _get(url, params))
+
+
+@_cached("full")
+async def query_full_results(
+    question,
+    units=None,
+    timeout=None,
+    formats=None,
+    includepodid=None,
+    excludepodid=None,
+    podstate=None
+):
+    url, params = _full_results_request(question, units, timeout, formats, includepodid, excludepodid, podstate)
+    return _full_results_result(await _get(url, params))
+
+
+async def stream_simple_api(
+    question,
+    units=None,
+    timeout=None,
+    layout=None,
+    background=None,
+    foreground=None,
+    fontsize=None,
+    width=None,
+):
+    url, params = _simple_request(question, units, timeout, layout, background, foreground, fontsize, width)
+    await _acquire("simple")
+    endpoint = _admit(url, params)
+    started = time.perf_counter()
+    status = None
+    try:
+        async with async_http_client.stream("GET", url, params=params) as response:
+            status = response.status_code
+            metrics.record_upstream("simple", status, time.perf_counter() - started)
+            _record(endpoint, status, time.perf_counter() - started)
+            content_type = response.headers.get("Content-Type", "")
+            if response.status_code != 200 or "image" not in content_type:
+                await response.aread()
+                _simple_result(response)
+            yield content_type
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                yield chunk
+    except httpx.TimeoutException:
+        if status is None:
+            _record(endpoint, "timeout", time.perf_counter() - started)
+        raise WolframAPIError("Wolfram|Alpha API timed out.")
+    except httpx.HTTPError as e:
+        if status is None:
+            _record(endpoint, "error", time.perf_counter() - started)
+        raise WolframAPIError(f"Failed to reach Wolfram|Alpha API ({type(e).__name__}).")
+
+
+async def stream_full_results(
+    question,
+    units=None,
+    timeout=None,
+    formats=None,
+    includepodid=None,
+    excludepodid=None,
+    podstate=None
+):
+    args = (question, units, timeout, formats, includepodid, excludepodid, podstate)
+    key = _full_results_key(*args)
+    hit, cached = response_cache.get(key, "full")
+    metrics.mark("cache", "hit" if hit else "miss")
+    if hit:
+        for event in _full_results_events(cached):
+            yield event
+        return
+
+    # Coalesced with concurrent calls for the same key; see wolfram_api.stream_full_results.
+    future, leader = wolfram_async_flight.begin(key)
+    if not leader:
+        result = await asyncio.shield(future)
+        if result is None:
+            # The leading stream was abandoned before it completed.
+            result = await query_full_results(*args)
+        for event in _full_results_events(result):
+            yield event
+        return
+    try:
+        # A previous leader may have filled the cache since our lookup.
+        found, result = response_cache.get(key, "full", count=False)
+        if found:
+            for event in _full_results_events(result):
+                yield event
+        else:
+            stream = _FullResultsStream()
+            async for event in _stream_full_results(key, args, stream):
+                yield event
+            result = stream.result
+    except Exception as e:
+        wolfram_async_flight.end(key, future, error=e)
+        raise
+    except BaseException:
+        wolfram_async_flight.end(key, future)
+        raise
+    wolfram_async_flight.end(key, future, result)
+
+
+async def _stream_full_results(key, args, stream):
+    url, params = _full_results_request(*args)
+    await _acquire("full")
+    endpoint = _admit(url, params)
+    started = time.perf_counter()
+    status = None
+    try:
+        async with async_http_client.stream("GET", url, params=params) as response:
+            status = response.status_code
+            metrics.record_upstream("full", status, time.perf_counter() - started)
+            _record(endpoint, status, time.perf_counter() - started)
+            if response.status_code != 200:
+                await response.aread()
+                raise WolframAPIError(f"Full Results API error: {response.status_code} - {response.text}")
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                for event in stream.feed(chunk):
+                    yield event
+            for event in stream.finish():
+                yield event
+    except httpx.TimeoutException:
+        if status is None:
+            _record(endpoint, "timeout", time.perf_counter() - started)
+        raise WolframAPIError("Wolfram|Alpha API timed out.")
+    except httpx.HTTPError as e:
+        if status is None:
+            _record(endpoint, "error", time.perf_counter() - started)
+        raise WolframAPIError(f"Failed to reach Wolfram|Alpha API ({type(e).__name__}).")
+    response_cache.set(key, "full", stream.result)
+
+
+async def query_pod_index(question, units=None, timeout=None):
+    full_result = await query_full_results(question, units=units, timeout=timeout, formats=["plaintext"])
+    return _pod_index(full_result)
+
+
+async def query_pod(question, podid, podstate=None, formats=None, units=None, timeout=None):
+    full_result = await query_full_results(
+        question,
+        units=units,
+        timeout=timeout,
+        formats=formats,
+        includepodid=podid,
+        podstate=podstate,
+    )
+    return _select_pod(full_result, podid)
+
+
+@_cached("llm")
+async def query_llm_api(question, maxchars=None):
+    url, params = _llm_request(question, maxchars)
+    return _llm_result(await _get(url, params))
+
+
+MODES = {
+    "short_answer": query_short_answer,
+    "spoken_result": query_spoken_result,
+    "simple": query_simple_api,
+    "full": query_full_results,
+    "llm": query_llm_api,
+}
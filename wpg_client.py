@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+import http_client
+import metrics
+from config import QUEZZIO_URLS, WPG_TOKEN_REFRESH_MARGIN, WPG_TOKEN_DEFAULT_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class WPGError(Exception):
+    pass
+
+
+class WPGCredentialsError(WPGError):
+    pass
+
+
+# Quezzio endpoint -> label for upstream metrics
+_ENDPOINT_MODES = {url: f"wpg_{name}" for name, url in QUEZZIO_URLS.items()}
+
+
+def _load_credentials():
+    client_id = os.environ.get("WPG_CLIENT_ID")
+    client_secret = os.environ.get("WPG_CLIENT_SECRET")
+    realm = os.environ.get("WPG_REALM", "futurestateuniversity")
+    if not client_id or not client_secret:
+        raise WPGCredentialsError("Missing WPG credentials in environment variables")
+    return client_id, client_secret, realm
+
+
+class TokenManager:
+    """
+    Caches the Quezzio client-credentials access token and refreshes it in the
+    background shortly before it expires. Safe to share across threads.
+    """
+
+    def __init__(self, token_url, refresh_margin=WPG_TOKEN_REFRESH_MARGIN, default_ttl=WPG_TOKEN_DEFAULT_TTL):
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._timer = None
+
+    def get_token(self, force=False):
+        """
+        Returns a valid access token, fetching a new one if none is cached,
+        the cached one has expired, or force is set.
+        """
+        token = self._token
+        if not force and token and time.time() < self._expires_at:
+            return token
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock.
+            if not force and self._token and time.time() < self._expires_at:
+                return self._token
+            if force and self._token != token:
+                return self._token
+            return self._refresh_locked()
+
+    def cached_token(self):
+        """
+        Returns the cached token if it is still valid, otherwise None. Never blocks on I/O.
+        """
+        token = self._token
+        if token and time.time() < self._expires_at:
+            return token
+        return None
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+            self._cancel_timer()
+
+    def _refresh_locked(self):
+        token, expires_in = self._fetch()
+        self._token = token
+        self._expires_at = time.time() + expires_in
+        self._schedule_refresh(expires_in)
+        return token
+
+    def _fetch(self):
+        client_id, client_secret, realm = _load_credentials()
+        payload = f'grant_type=client_credentials&auth_details={{"client_id":"{client_id}","client_secret":"{client_secret}"}}&realm={realm}'
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        with metrics.upstream(_ENDPOINT_MODES.get(self.token_url, "wpg")) as call:
+            try:
+                response = http_client.post(self.token_url, headers=headers, data=payload)
+            except requests.RequestException as e:
+                raise WPGError(f"Failed to get access token ({type(e).__name__})")
+            call.status = response.status_code
+        if response.status_code != 200:
+            raise WPGError("Failed to get access token")
+
+        data = response.json()
+        token = data.get("access_token")
+        if not token:
+            raise WPGError("No access token returned")
+        try:
+            expires_in = float(data.get("expires_in") or self.default_ttl)
+        except (TypeError, ValueError):
+            expires_in = self.default_ttl
+        return token, expires_in
+
+    def _schedule_refresh(self, expires_in):
+        self._cancel_timer()
+        # Short-lived tokens are refreshed at 80% of their lifetime instead.
+        delay = max(min(expires_in - self.refresh_margin, expires_in * 0.8), 1)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _background_refresh(self):
+        with self._lock:
+            try:
+                self._refresh_locked()
+            except WPGError as e:
+                # Keep serving the current token; the next caller past expiry refetches.
+                logger.warning("Background WPG token refresh failed: %s", e)
+
+
+token_manager = TokenManager(QUEZZIO_URLS["token"])
+
+
+def question_payload(wpg_input):
+    """
+    Form body for the Quezzio question endpoint.
+    """
+    return {
+        "wpg_input": json.dumps(wpg_input),
+        "output_format": "MathML",
+        "show_steps_command": "true"
+    }
+
+
+def post(url, **kwargs):
+    """
+    POSTs to a Quezzio endpoint with the cached bearer token. A 401 forces one
+    token refresh and a single retry.
+    Raises WPGError if no token can be obtained or the endpoint is unreachable.
+    """
+    headers = dict(kwargs.pop("headers", None) or {})
+    token = token_manager.get_token()
+    for attempt in range(2):
+        headers["Authorization"] = f"Bearer {token}"
+        with metrics.upstream(_ENDPOINT_MODES.get(url, "wpg")) as call:
+            try:
+                response = http_client.post(url, headers=headers, **kwargs)
+            except requests.RequestException as e:
+                raise WPGError(f"Failed to reach WPG API ({type(e).__name__})")
+            call.status = response.status_code
+        if response.status_code != 401 or attempt:
+            return response
+        token = token_manager.get_token(force=True)
+    return response
+
+
+async def post_async(url, **kwargs):
+    """
+    asyncio counterpart of post() for the ASGI app. Token fetches, which are
+    rare, run in a worker thread so the event loop never blocks on them.
+    """
+    import httpx
+    import async_http_client
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    token = token_manager.cached_token() or await asyncio.to_thread(token_manager.get_token)
+    for attempt in range(2):
+        headers["Authorization"] = f"Bearer {token}"
+        with metrics.upstream(_ENDPOINT_MODES.get(url, "wpg")) as call:
+            try:
+                response = await async_http_client.post(url, headers=headers, **kwargs)
+            except httpx.HTTPError as e:
+                raise WPGError(f"Failed to reach WPG API ({type(e).__name__})")
+            call.status = response.status_code
+        if response.status_code != 401 or attempt:
+            return response
+        token = await asyncio.to_thread(token_manager.get_token, True)
+    return response
@@ -0,0 +1,319 @@
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import wpg_client
+from config import (
+    QUEZZIO_URLS,
+    WPG_STORE_PATH,
+    WPG_TOPICS_TTL,
+    WPG_QUESTIONS_TTL,
+    WPG_POOL_SIZE,
+)
+from wpg_client import WPGError
+
+logger = logging.getLogger(__name__)
+
+# Difficulty levels offered by the practice test page
+DIFFICULTIES = ("Beginner", "Intermediate", "Advanced")
+DEFAULT_ANSWER_TYPE = "Single Expression"
+
+# wpg_input entry keys a pooled question can stand in for; entries with other keys always go upstream
+_POOLED_KEYS = {"wpg_topic", "wpg_instances", "wpg_difficulty", "wpg_answer_type"}
+
+
+def _pool_key(topic, difficulty, answer_type):
+    return "\x1f".join((topic, difficulty, answer_type))
+
+
+def _pooled_entries(wpg_input):
+    """
+    Returns [(pool key, spec, instances), ...] for a /wpg/questions input, or
+    None if any entry asks for something a question pool cannot serve.
+    """
+    if not isinstance(wpg_input, list) or not wpg_input:
+        return None
+    entries = []
+    for entry in wpg_input:
+        if not isinstance(entry, dict) or not set(entry) <= _POOLED_KEYS:
+            return None
+        topic = entry.get("wpg_topic")
+        difficulty = entry.get("wpg_difficulty", DIFFICULTIES[0])
+        answer_type = entry.get("wpg_answer_type", DEFAULT_ANSWER_TYPE)
+        instances = entry.get("wpg_instances", 1)
+        if not all(isinstance(v, str) for v in (topic, difficulty, answer_type)):
+            return None
+        if not isinstance(instances, int) or instances <= 0:
+            return None
+        spec = (topic, difficulty, answer_type)
+        entries.append((_pool_key(*spec), spec, instances))
+    return entries
+
+
+class WPGStore:
+    """
+    Local precomputed store for Quezzio: the topic catalog and, per (topic,
+    difficulty, answer type), a pool of already generated questions, kept in
+    a JSON file. Lookups never call upstream. Entries older than their TTL
+    are still served while a background refresh replaces them
+    (stale-while-revalidate); misses are left to the caller, whose upstream
+    response is then recorded here.
+    """
+
+    def __init__(self, path, topics_ttl, questions_ttl, pool_size):
+        self.path = path
+        self.topics_ttl = topics_ttl
+        self.questions_ttl = questions_ttl
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._topics = None  # {"data": ..., "fetched_at": ...}
+        self._pools = {}  # pool key -> {"spec": [...], "questions": [...], "fetched_at": ...}
+        self._mtime = None
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="wpg-store")
+        # Writes happen off the request path, coalesced into one pending save.
+        self._saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="wpg-store-save")
+        self._save_pending = False
+        self._stats = {"topic_hits": 0, "topic_misses": 0, "question_hits": 0, "question_misses": 0, "refreshes": 0, "refresh_errors": 0}
+        self._load()
+
+    # --- topic catalog ---
+
+    def get_topics(self):
+        """
+        Returns (True, topics) if the catalog is stored, else (False, None).
+        A stale catalog is returned as well and refreshed in the background.
+        """
+        self._reload_if_changed()
+        with self._lock:
+            entry = self._topics
+            self._stats["topic_hits" if entry else "topic_misses"] += 1
+        if entry is None:
+            return False, None
+        if time.time() - entry["fetched_at"] > self.topics_ttl:
+            self._refresh_in_background("topics", self._refresh_topics)
+        return True, entry["data"]
+
+    def put_topics(self, topics):
+        with self._lock:
+            self._topics = {"data": topics, "fetched_at": time.time()}
+        self._save_soon()
+
+    def _refresh_topics(self):
+        response = wpg_client.post(QUEZZIO_URLS["topics"])
+        if response.status_code != 200:
+            raise WPGError(f"Failed to fetch topics ({response.status_code})")
+        self.put_topics(response.json())
+
+    # --- question pools ---
+
+    def get_questions(self, wpg_input):
+        """
+        Returns a /wpg/questions response for wpg_input drawn from the question
+        pools (a random sample of each pool, one list per input entry), or None
+        if any entry cannot be served from them. Stale or short pools are
+        refilled in the background.
+        """
+        entries = _pooled_entries(wpg_input)
+        if entries is None:
+            return None
+        self._reload_if_changed()
+        now = time.time()
+        result, refill = [], []
+        with self._lock:
+            for key, spec, instances in entries:
+                pool = self._pools.get(key)
+                questions = pool["questions"] if pool else ()
+                if len(questions) < self.pool_size or now - pool["fetched_at"] > self.questions_ttl:
+                    refill.append(spec)
+                if len(questions) < instances:
+                    result = None
+                    continue
+                if result is not None:
+                    result.append(random.sample(questions, instances))
+            self._stats["question_hits" if result is not None else "question_misses"] += 1
+        # A miss is fetched by the caller and recorded by put_questions, which refills as needed.
+        if result is not None and refill:
+            self._refill_in_background(refill)
+        return result
+
+    def put_questions(self, wpg_input, response):
+        """
+        Adds the questions of an upstream /wpg/questions response to the pools
+        of the matching input entries, then tops up pools below the pool size.
+        """
+        entries = _pooled_entries(wpg_input)
+        if entries is None or not isinstance(response, list) or len(response) != len(entries):
+            return
+        now = time.time()
+        refill = []
+        with self._lock:
+            for (key, spec, _), questions in zip(entries, response):
+                if not isinstance(questions, list):
+                    continue
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = self._pools[key] = {"spec": list(spec), "questions": [], "fetched_at": now}
+                pool["questions"] = (pool["questions"] + questions)[-self.pool_size:]
+                if len(pool["questions"]) < self.pool_size:
+                    refill.append(spec)
+        self._save_soon()
+        if refill:
+            self._refill_in_background(refill)
+
+    def _fetch_pools(self, specs):
+        wpg_input = [
+            {"wpg_topic": topic, "wpg_instances": self.pool_size, "wpg_difficulty": difficulty, "wpg_answer_type": answer_type}
+            for topic, difficulty, answer_type in specs
+        ]
+        response = wpg_client.post(QUEZZIO_URLS["question"], data=wpg_client.question_payload(wpg_input))
+        if response.status_code != 200:
+            raise WPGError(f"Failed to fetch questions ({response.status_code})")
+        data = response.json()
+        if not isinstance(data, list) or len(data) != len(specs):
+            raise WPGError("Unexpected question response shape")
+        now = time.time()
+        with self._lock:
+            for spec, questions in zip(specs, data):
+                if isinstance(questions, list) and questions:
+                    self._pools[_pool_key(*spec)] = {"spec": list(spec), "questions": questions[:self.pool_size], "fetched_at": now}
+        self._save_soon()
+
+    def _refill_in_background(self, specs):
+        for spec in specs:
+            self._refresh_in_background(_pool_key(*spec), self._fetch_pools, [spec])
+
+    # --- warm-up ---
+
+    def warm(self, topics=None, difficulties=DIFFICULTIES, answer_type=DEFAULT_ANSWER_TYPE, batch_size=10, questions=True):
+        """
+        Fetches the topic catalog and fills the question pool of every catalog
+        topic (or only the given ones) at each difficulty. Runs synchronously;
+        returns the number of pools filled. Upstream failures are logged and
+        skipped so one bad batch does not stop the job.
+        """
+        self._refresh_topics()
+        if not questions:
+            self._save()
+            return 0
+        with self._lock:
+            catalog = self._topics["data"]
+        names = topics or [name for subtopics in catalog.values() for name in subtopics]
+        specs = [(name, difficulty, answer_type) for name in names for difficulty in difficulties]
+        filled = 0
+        for start in range(0, len(specs), batch_size):
+            batch = specs[start:start + batch_size]
+            try:
+                self._fetch_pools(batch)
+            except (WPGError, ValueError) as e:
+                logger.warning("WPG warm-up batch starting at %s failed: %s", batch[0], e)
+                continue
+            filled += len(batch)
+        self._save()
+        return filled
+
+    def warm_in_background(self, **kwargs):
+        def run():
+            try:
+                filled = self.warm(**kwargs)
+                logger.info("WPG store warmed: topic catalog and %d question pools", filled)
+            except (WPGError, ValueError) as e:
+                logger.warning("WPG store warm-up failed: %s", e)
+
+        threading.Thread(target=run, name="wpg-store-warm", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pools"] = len(self._pools)
+            stats["questions"] = sum(len(pool["questions"]) for pool in self._pools.values())
+            stats["topics"] = self._topics is not None
+        return stats
+
+    # --- background refresh and persistence ---
+
+    def _refresh_in_background(self, key, func, *args):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                func(*args)
+                with self._lock:
+                    self._stats["refreshes"] += 1
+            except (WPGError, ValueError) as e:
+                # Keep serving what is stored; the next stale read tries again.
+                logger.warning("WPG store refresh of %r failed: %s", key, e)
+                with self._lock:
+                    self._stats["refresh_errors"] += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable WPG store %s: %s", self.path, e)
+            return
+        with self._lock:
+            self._topics = data.get("topics")
+            self._pools = data.get("pools", {})
+            self._mtime = mtime
+
+    def _reload_if_changed(self):
+        # Picks up files written by the warm-up CLI or another worker process.
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._load()
+
+    def _save_soon(self):
+        with self._lock:
+            if self._save_pending:
+                return
+            self._save_pending = True
+        self._saver.submit(self._save)
+
+    def _save(self):
+        with self._lock:
+            self._save_pending = False
+            raw = json.dumps({"topics": self._topics, "pools": self._pools}, separators=(",", ":"))
+        with self._write_lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(raw)
+                os.replace(tmp_path, self.path)
+                self._mtime = os.path.getmtime(self.path)
+            except OSError as e:
+                logger.warning("Could not write WPG store %s: %s", self.path, e)
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+def _create_store():
+    if not WPG_STORE_PATH:
+        return None
+    return WPGStore(WPG_STORE_PATH, WPG_TOPICS_TTL, WPG_QUESTIONS_TTL, WPG_POOL_SIZE)
+
+
+wpg_store = _create_store()